@@ -0,0 +1,115 @@
+"""
+Access token management for the trading accounts.
+The stored token is reused while Kite still accepts it, which costs one profile() call; a login only
+runs when there is no stored token or it has expired. With config.login_mode "http" it is the
+browserless login of http_login, falling back to the headless Chrome login of browser_test if that fails.
+The new token is set on the client the engine already holds, so nothing has to be rebuilt after a login.
+"""
+import asyncio
+from kiteconnect import KiteConnect
+import kiteconnect.exceptions as ex
+import browser_test
+import config
+import http_login
+import login_pool
+import state_store
+
+
+def http_login_token(user_id: str):
+    """
+    Logs the user in over HTTP. Returns the new access token, already stored, or None if the login failed
+    for any reason, including a missing TOTP secret or an unexpected answer, so the browser login can run.
+    """
+    try:
+        return http_login.generate_http_access_token(user_id)
+    except Exception as e:
+        print(f"{user_id}: HTTP login failed, falling back to the browser: {str(e)}")
+        return None
+
+
+def login(user_id: str):
+    """Logs the user in as config.login_mode says. Returns the new access token, already stored, or None if the login failed."""
+    if config.login_mode == "http":
+        access_token = http_login_token(user_id)
+        if access_token is not None:
+            return access_token
+    return browser_test.generate_automated_access_token(user_id)
+
+
+def token_valid(kite) -> bool:
+    """Returns whether Kite accepts the client's access token"""
+    try:
+        kite.profile()
+    except ex.TokenException:
+        return False
+    return True
+
+
+async def token_valid_async(kite) -> bool:
+    """Returns whether Kite accepts the AsyncKite client's access token"""
+    try:
+        await kite.profile()
+    except ex.TokenException:
+        return False
+    return True
+
+
+def ensure_access_token(kite, user_id: str, access_token=None):
+    """
+    Sets a working access token on kite and returns it: access_token, by default the stored one,
+    when Kite accepts it, else the token of a new login. Raises TokenException if the login fails.
+    """
+    if access_token is None:
+        access_token = state_store.get_access_token(user_id)
+    if access_token:
+        kite.set_access_token(access_token)
+        if token_valid(kite):
+            print(f"{user_id}: Reusing the stored access token")
+            return access_token
+        print(f"{user_id}: Stored access token expired, logging in")
+    access_token = login(user_id)
+    if access_token is None:
+        raise ex.TokenException(f"{user_id}: Login failed, no access token")
+    kite.set_access_token(access_token)
+    return access_token
+
+
+async def ensure_access_token_async(kite, user_id: str, access_token=None):
+    """ensure_access_token for an AsyncKite client; the blocking login runs on a worker thread"""
+    if access_token is None:
+        access_token = await asyncio.to_thread(state_store.get_access_token, user_id)
+    if access_token:
+        kite.set_access_token(access_token)
+        if await token_valid_async(kite):
+            print(f"{user_id}: Reusing the stored access token")
+            return access_token
+        print(f"{user_id}: Stored access token expired, logging in")
+    access_token = await asyncio.to_thread(login, user_id)
+    if access_token is None:
+        raise ex.TokenException(f"{user_id}: Login failed, no access token")
+    kite.set_access_token(access_token)
+    return access_token
+
+
+def refresh_access_tokens(user_ids):
+    """
+    Checks the stored token of every account and logs the ones without a working token in, over HTTP
+    in "http" login mode, and the rest concurrently with login_pool.login_all.
+    An account whose token cannot be checked, e.g. on a network error, is left to its engine's own
+    ensure_access_token call. Returns the browser login timings, empty when no browser login was needed.
+    """
+    expired = []
+    for user_id in user_ids:
+        try:
+            access_token = state_store.get_access_token(user_id)
+            kite = KiteConnect(api_key=config.config_keys[user_id]["api_key"], access_token=access_token)
+            if not access_token or not token_valid(kite):
+                expired.append(user_id)
+        except Exception as e:
+            print(f"{user_id}: Failed to check the stored access token, leaving the login to the engine: {str(e)}")
+    if config.login_mode == "http":
+        expired = [user_id for user_id in expired if http_login_token(user_id) is None]
+    if not expired:
+        return {}
+    print(f"Logging in {', '.join(expired)} with the browser")
+    return login_pool.login_all(expired)[1]
@@ -0,0 +1,89 @@
+"""
+Minimal asyncio client for the Kite Connect REST endpoints used by the trading engine.
+Mirrors the KiteConnect method names and return values so engine code reads the same,
+and raises the same kiteconnect exceptions on API errors.
+"""
+import aiohttp
+from kiteconnect import KiteConnect
+import kiteconnect.exceptions as ex
+from rate_limiter import throttle_async
+
+
+class AsyncKite:
+    """Async counterpart of KiteConnect sharing one aiohttp session per client"""
+    VARIETY_REGULAR = KiteConnect.VARIETY_REGULAR
+    TRANSACTION_TYPE_BUY = KiteConnect.TRANSACTION_TYPE_BUY
+    TRANSACTION_TYPE_SELL = KiteConnect.TRANSACTION_TYPE_SELL
+    ORDER_TYPE_LIMIT = KiteConnect.ORDER_TYPE_LIMIT
+    PRODUCT_CNC = KiteConnect.PRODUCT_CNC
+    VALIDITY_DAY = KiteConnect.VALIDITY_DAY
+
+    def __init__(self, api_key, access_token=None, root=KiteConnect._default_root_uri, session=None, timeout=7):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.root = root.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = session
+        self.own_session = session is None
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+
+    async def __aenter__(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _request(self, method, path, category, params=None, data=None):
+        await throttle_async(self, category)
+        headers = {"X-Kite-Version": "3"}
+        if self.access_token:
+            headers["Authorization"] = f"token {self.api_key}:{self.access_token}"
+        async with self.session.request(method, self.root + path, params=params, data=data, headers=headers) as response:
+            if "json" not in response.headers.get("content-type", ""):
+                raise ex.DataException(f"Unknown Content-Type ({response.headers.get('content-type')}) with response: ({await response.text()})")
+            body = await response.json()
+        if body.get("status") == "error" or body.get("error_type"):
+            exception = getattr(ex, body.get("error_type") or "", ex.GeneralException)
+            raise exception(body.get("message"), code=response.status)
+        return body["data"]
+
+    async def ltp(self, *instruments):
+        instruments = instruments[0] if len(instruments) == 1 and isinstance(instruments[0], list) else list(instruments)
+        return await self._request("GET", "/quote/ltp", "quote", params=[("i", instrument) for instrument in instruments])
+
+    async def quote(self, *instruments):
+        instruments = instruments[0] if len(instruments) == 1 and isinstance(instruments[0], list) else list(instruments)
+        return await self._request("GET", "/quote", "quote", params=[("i", instrument) for instrument in instruments])
+
+    async def orders(self):
+        return await self._request("GET", "/orders", "other")
+
+    async def order_history(self, order_id):
+        return await self._request("GET", f"/orders/{order_id}", "other")
+
+    async def place_order(self, variety, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        data = await self._request("POST", f"/orders/{variety}", "order", data=params)
+        return data["order_id"]
+
+    async def cancel_order(self, variety, order_id):
+        data = await self._request("DELETE", f"/orders/{variety}/{order_id}", "order")
+        return data["order_id"]
+
+    async def holdings(self):
+        return await self._request("GET", "/portfolio/holdings", "other")
+
+    async def positions(self):
+        return await self._request("GET", "/portfolio/positions", "other")
+
+    async def profile(self):
+        return await self._request("GET", "/user/profile", "other")
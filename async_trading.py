@@ -0,0 +1,270 @@
+"""
+Asyncio version of the multiple_trading engine.
+Every account runs as an AsyncGridTrader on one event loop: price fetching, order placement
+and reconciliation are separate tasks, and no account needs a thread of its own.
+"""
+import asyncio
+import time
+from datetime import datetime, time as dt_time
+import aiohttp
+import access_tokens
+import config
+import grid_strategy
+from grid_book import GridBook
+import kite_functions
+import kite_metrics
+import state_store
+from async_kite import AsyncKite
+from multiple_trading import market_closed
+
+
+async def wait_for_market_open(user_id: str):
+    """Function to wait until the market opens at 9:15 am without blocking the event loop"""
+    now = datetime.now()
+    start_time = dt_time(9, 15)
+    if now.time() < start_time:
+        wait_seconds = (datetime.combine(now.date(), start_time) - now).total_seconds()
+        print(f"{user_id}: Waiting until 9:15 am to start trading... Sleeping for {int(wait_seconds)} seconds.")
+        await asyncio.sleep(wait_seconds + 10)
+
+
+class AsyncGridTrader(GridBook):
+    """
+    Class to run the grid strategy for one account on an asyncio event loop.
+    It owns the account's GridBook state, so any number of traders can share a loop.
+    """
+    def __init__(self, kite, state, symbols: dict, exchange: str, percent: int, cycle_interval=config.cycle_interval):
+        super().__init__(state.user_id, state, symbols, percent)
+        self.kite = kite
+        self.exchange = exchange
+        self.cycle_interval = cycle_interval
+        self.prices = {}
+        self.snapshots = asyncio.Queue(maxsize=1)
+        # Serialises order placement and reconciliation, which both change the state above
+        self.lock = asyncio.Lock()
+        self.nifty_quote = (0, None)
+
+    async def get_prices(self, symbols):
+        """Returns a {symbol: last_price} snapshot, split at the ltp instrument limit and fetched concurrently"""
+        symbols = list(symbols)
+        chunks = [symbols[start:start + kite_functions.LTP_INSTRUMENT_LIMIT] for start in range(0, len(symbols), kite_functions.LTP_INSTRUMENT_LIMIT)]
+        results = await asyncio.gather(*[self.kite.ltp([f"{self.exchange}:{symbol}" for symbol in chunk]) for chunk in chunks],
+                                       return_exceptions=True)
+        prices = {}
+        for result in results:
+            if isinstance(result, Exception):
+                self.log(f"Error fetching prices: {str(result)}")
+                continue
+            for instrument, quote in result.items():
+                prices[instrument.split(":", 1)[1]] = quote["last_price"]
+        return prices
+
+    async def get_nifty_day_change(self):
+        """Returns the NIFTY 50 day change in percent, reusing the quote for config.cache_ttl["quote"] seconds"""
+        expiry, change = self.nifty_quote
+        if change is None or expiry <= time.monotonic():
+            instrument = "NSE:NIFTY 50"
+            quote = (await self.kite.quote([instrument]))[instrument]
+            prev_close = quote["ohlc"]["close"]
+            change = (quote["last_price"] - prev_close) / prev_close * 100
+            self.nifty_quote = (time.monotonic() + config.cache_ttl["quote"], change)
+        return change
+
+    async def place_order(self, symbol, quantity, price, side):
+        """Function to place a limit CNC order, returning the order id or None"""
+        try:
+            order_id = await self.kite.place_order(
+                variety=self.kite.VARIETY_REGULAR,
+                tradingsymbol=symbol,
+                exchange=self.exchange,
+                transaction_type=self.kite.TRANSACTION_TYPE_BUY if side == "BUY" else self.kite.TRANSACTION_TYPE_SELL,
+                quantity=quantity,
+                order_type=self.kite.ORDER_TYPE_LIMIT,
+                price=price,
+                product=self.kite.PRODUCT_CNC,
+                validity=self.kite.VALIDITY_DAY,
+            )
+            self.log(f"{side} order placed successfully. Order ID: {order_id}")
+            return order_id
+        except Exception as e:
+            self.log(f"Failed to place order for {symbol}: {str(e)}")
+            return None
+
+    async def cancel_order(self, order_id):
+        try:
+            await self.kite.cancel_order(variety=self.kite.VARIETY_REGULAR, order_id=order_id)
+            self.log(f"Order {order_id} cancelled")
+        except Exception as e:
+            self.log(f"Failed to delete order {order_id}: {str(e)}")
+
+    async def load(self):
+        """Loads base price and number of trades of every symbol in the state, pricing new symbols from one snapshot"""
+        missing_symbols = self.select_symbols()
+        self.load_symbols(missing_symbols, await self.get_prices(missing_symbols) if missing_symbols else {})
+
+    async def fetch_prices(self):
+        """Task fetching one price snapshot per cycle; order placement always works on the latest one"""
+        while True:
+            cycle_start = time.monotonic()
+            prices = await self.get_prices(self.trading_symbols)
+            if self.snapshots.full():
+                self.snapshots.get_nowait()
+            self.snapshots.put_nowait(prices)
+            await asyncio.sleep(max(0, self.cycle_interval - (time.monotonic() - cycle_start)))
+
+    async def place_orders(self):
+        """Task applying the grid rules to every price snapshot and placing the resulting orders concurrently"""
+        while True:
+            prices = await self.snapshots.get()
+            try:
+                await self.process_snapshot(prices)
+            except Exception as e:
+                self.log(f"Processing prices failed: {str(e)}. Retrying with the next snapshot...")
+
+    async def process_snapshot(self, prices):
+        """Applies the grid rules to one price snapshot and places the resulting orders concurrently"""
+        self.prices = prices
+        if self.trade_counts["buy_trades"] >= grid_strategy.DAILY_BUY_CAP:
+            self.log(f"Total buy trades reached {grid_strategy.DAILY_BUY_CAP}. No more buying will be done.")
+        nifty_day_change = None
+        async with self.lock:
+            actions = {}
+            for symbol in self.trading_symbols:
+                current_price = prices.get(symbol)
+                if current_price is None:
+                    continue
+                action = self.decide(symbol, current_price, lambda: float("inf"))
+                if action == grid_strategy.BUY:
+                    # The NIFTY filter only matters once a symbol reaches its buy price, so fetch it lazily
+                    if nifty_day_change is None:
+                        nifty_day_change = await self.get_nifty_day_change()
+                    if nifty_day_change <= grid_strategy.NIFTY_FLOOR:
+                        continue
+                if action is not None:
+                    actions[symbol] = action
+            await asyncio.gather(*[self.act(symbol, action, prices[symbol]) for symbol, action in actions.items()])
+            await asyncio.to_thread(self.state.end_cycle)
+
+    async def act(self, symbol, action, current_price):
+        """Places the order for one grid action and updates the symbol's state once it is accepted"""
+        side = self.order_side(action)
+        order_id = None
+        if side is not None:
+            self.log_action(symbol, action, current_price)
+            order_id = await self.place_order(symbol, self.symbols[symbol], current_price, side)
+        self.apply_action(symbol, action, order_id)
+
+    async def current_price(self, symbol):
+        """Returns the symbol's price from the latest snapshot, fetching it if the snapshot has none"""
+        return self.prices.get(symbol) or (await self.get_prices([symbol])).get(symbol)
+
+    async def roll_back_order(self, symbol, order):
+        """Rolls back the state change of a cancelled order, squaring off any partially filled quantity"""
+        square_off = self.square_off(symbol, order)
+        if square_off is not None:
+            side, quantity = square_off
+            square_off_price = await self.current_price(symbol)
+            self.log(f"Placing square off {side.lower()} order for {symbol} at {square_off_price}")
+            await self.place_order(symbol, quantity, square_off_price, side)
+        self.roll_back(symbol, order, await self.current_price(symbol) if self.roll_back_needs_price(symbol, order) else None)
+
+    async def reconcile_once(self, min_age=0):
+        """
+        Reconciles every open order placed at least min_age seconds ago, like multiple_trading.reconcile_open_orders:
+        completed orders are counted, the rest are cancelled concurrently and rolled back once they have a final status.
+        """
+        due = self.due_orders(min_age)
+        if not due:
+            return
+        unfinished = self.record_completed_orders(due, {order["order_id"]: order for order in await self.kite.orders()})
+        if not unfinished:
+            return
+        await asyncio.gather(*[self.cancel_order(order_id) for order_id in unfinished.values()])
+        order_book = {order["order_id"]: order for order in await self.kite.orders()}
+        for _ in range(config.cancel_poll_attempts - 1):
+            if not self.cancel_pending(unfinished, order_book):
+                break
+            await asyncio.sleep(config.cancel_poll_interval)
+            order_book = {order["order_id"]: order for order in await self.kite.orders()}
+        cancelled = self.settle_cancelled_orders(unfinished, order_book)
+        await asyncio.gather(*[self.roll_back_order(symbol, order) for symbol, order in cancelled.items()])
+
+    async def reconcile(self):
+        """Task reconciling orders once they have had a full cycle to fill"""
+        while True:
+            await asyncio.sleep(self.cycle_interval)
+            try:
+                async with self.lock:
+                    await self.reconcile_once(min_age=self.cycle_interval)
+            except Exception as e:
+                self.log(f"Reconciliation failed: {str(e)}. Retrying next cycle...")
+
+    async def run(self):
+        """Runs the price, order and reconciliation tasks until the market closes"""
+        await wait_for_market_open(self.user_id)
+        print(f"{self.user_id}: Starting async trading process for {self.user_id}")
+        await self.load()
+        # Orders an earlier run left open, e.g. a worker the supervisor restarted, are settled before trading
+        async with self.lock:
+            if self.adopt_open_orders(await self.kite.orders()):
+                await self.reconcile_once()
+        tasks = [asyncio.create_task(self.fetch_prices()),
+                 asyncio.create_task(self.place_orders()),
+                 asyncio.create_task(self.reconcile())]
+        try:
+            while not market_closed():
+                done = [task for task in tasks if task.done()]
+                if done:
+                    # A task only ends on an unexpected error; surface it
+                    done[0].result()
+                await asyncio.sleep(1)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        async with self.lock:
+            await self.reconcile_once()
+        await self.close_trading_day()
+
+    async def close_trading_day(self):
+        self.log("Market closed. Exiting...")
+        self.log(f"Total buy trades: {self.trade_counts['buy_trades']}")
+        self.log(f"Total sell trades: {self.trade_counts['sell_trades']}")
+        self.log(f"Total base changes: {self.trade_counts['base_change']}")
+        await asyncio.to_thread(self.state.close)
+        await asyncio.to_thread(state_store.append_trading_orders, self.user_id, self.trade_counts["buy_trades"],
+                                self.trade_counts["sell_trades"], self.trade_counts["base_change"])
+
+
+async def run_account(session, user_id: str, symbols: dict, exchange: str, percent: int):
+    """Logs one account in and trades it until the market closes, sharing the HTTP session of the loop"""
+    user_state = await asyncio.to_thread(state_store.load_user_state, user_id)
+    kite = kite_metrics.instrument(AsyncKite(config.config_keys[user_id]["api_key"], session=session))
+    # The stored token is reused if Kite still accepts it; the blocking browser login only runs when it does not
+    await access_tokens.ensure_access_token_async(kite, user_id, user_state["access_token"])
+    state = state_store.open_user_state(user_id, loaded=user_state)
+    try:
+        await AsyncGridTrader(kite, state, symbols, exchange, percent).run()
+    finally:
+        await asyncio.to_thread(state.close)
+
+
+async def run_accounts(user_ids, symbols: dict, exchange: str, percent: int):
+    """Trades all the accounts concurrently on the running event loop"""
+    kite_metrics.start_dump()
+    # Expired accounts are logged in together from a shared browser pool before trading starts
+    await asyncio.to_thread(access_tokens.refresh_access_tokens, user_ids)
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=7)) as session:
+            results = await asyncio.gather(*[run_account(session, user_id, symbols, exchange, percent) for user_id in user_ids],
+                                           return_exceptions=True)
+    finally:
+        # The periodic dump misses the calls of the last interval, including the final reconciliation
+        kite_metrics.write_dump()
+    for user_id, result in zip(user_ids, results):
+        if isinstance(result, Exception):
+            print(f"{user_id}: Trading stopped with an error: {result!r}")
+
+
+if __name__ == '__main__':
+    asyncio.run(run_accounts(config.ID, config.shares_quantity, "NSE", 3))
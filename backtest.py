@@ -0,0 +1,142 @@
+"""
+Backtester for the multiple_trading grid strategy.
+Replays minute bars for the whole symbol universe at once: the state of every symbol is a
+column in a few NumPy arrays, and each bar is decided with grid_strategy.decide_actions, the
+array version of the rules the live engine runs. Orders are assumed to fill at the bar's price.
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+import config
+import grid_strategy
+
+
+def load_minute_bars(file_name: str, nifty_symbol="NIFTY 50"):
+    """
+    Loads minute bars from a CSV with "timestamp", "symbol" and "close" columns.
+    Returns (timestamps, symbols, prices, nifty_day_change): prices has one row per timestamp and one
+    column per symbol, NaN where a symbol has no bar. nifty_day_change is None unless nifty_symbol is in the file.
+    """
+    bars = pd.read_csv(file_name, parse_dates=["timestamp"])
+    table = bars.pivot_table(index="timestamp", columns="symbol", values="close", aggfunc="last").sort_index()
+    nifty_day_change = None
+    if nifty_symbol in table.columns:
+        nifty_day_change = day_change(table.index, table.pop(nifty_symbol).to_numpy(dtype=float))
+    return table.index.to_numpy(), list(table.columns), table.to_numpy(dtype=float), nifty_day_change
+
+
+def day_change(timestamps, prices):
+    """Returns the change in percent of every bar against the previous day's last close; 0 on the first day"""
+    days = pd.DatetimeIndex(timestamps).normalize()
+    closes = pd.Series(prices, index=timestamps).groupby(days).last()
+    previous_close = closes.shift(1).reindex(days).to_numpy()
+    change = (prices - previous_close) / previous_close * 100
+    return np.nan_to_num(change, nan=0.0)
+
+
+def backtest(prices, percent=3, quantities=None, days=None, nifty_day_change=None, symbols=None, timestamps=None,
+             max_lots=grid_strategy.MAX_LOTS, daily_buy_cap=grid_strategy.DAILY_BUY_CAP, nifty_floor=grid_strategy.NIFTY_FLOOR):
+    """
+    Runs the grid rules over prices, an array with one row per bar and one column per symbol (NaN for no bar).
+    Every symbol starts with no lots; its base price is set by the first buy.
+    quantities holds the shares per lot of each symbol (1 by default), days the trading day of every bar,
+    used to reset the daily buy cap, and nifty_day_change the NIFTY 50 day change in percent at every bar.
+    As in the live engine, buys placed on a bar count towards the daily cap from the next bar on.
+    max_lots, daily_buy_cap and nifty_floor override the live limits, e.g. for a parameter sweep.
+    Returns a dict of per-symbol arrays ("buy_trades", "sell_trades", "base_changes", "realized_pnl",
+    "unrealized_pnl", "lots", "base_price") and "trades", a list of (bar, symbol, action, price).
+    """
+    prices = np.asarray(prices, dtype=float)
+    bar_count, symbol_count = prices.shape
+    symbols = list(symbols) if symbols is not None else list(range(symbol_count))
+    quantities = np.ones(symbol_count) if quantities is None else np.asarray(quantities, dtype=float)
+    days = np.zeros(bar_count, dtype=int) if days is None else np.asarray(days)
+    nifty_day_change = np.zeros(bar_count) if nifty_day_change is None else np.asarray(nifty_day_change, dtype=float)
+    bars = timestamps if timestamps is not None else range(bar_count)
+
+    base_price = np.full(symbol_count, np.nan)
+    lots = np.zeros(symbol_count, dtype=int)
+    # Buy price of every lot held, the newest at lots - 1; the newest lot is the one sold first
+    lot_prices = np.full((symbol_count, max(max_lots, 1)), np.nan)
+    counts = np.zeros((len(grid_strategy.ACTIONS), symbol_count), dtype=int)
+    realized_pnl = np.zeros(symbol_count)
+    trades = []
+    buy_trades = 0
+
+    for bar in range(bar_count):
+        if bar == 0 or days[bar] != days[bar - 1]:
+            buy_trades = 0
+        price = prices[bar]
+        codes = grid_strategy.decide_actions(price, base_price, lots, buy_trades, percent, nifty_day_change[bar],
+                                             max_lots, daily_buy_cap, nifty_floor)
+        if not codes.any():
+            continue
+
+        first_buy = np.nonzero(codes == grid_strategy.FIRST_BUY_CODE)[0]
+        buy = np.nonzero(codes == grid_strategy.BUY_CODE)[0]
+        sell = np.nonzero(codes == grid_strategy.SELL_CODE)[0]
+        base_change = np.nonzero(codes == grid_strategy.BASE_CHANGE_CODE)[0]
+
+        # The first buy keeps the base price, which is the price the symbol started trading at
+        base_price[first_buy] = np.where(np.isnan(base_price[first_buy]), price[first_buy], base_price[first_buy])
+        bought = np.concatenate([first_buy, buy])
+        lot_prices[bought, lots[bought]] = price[bought]
+        lots[bought] += 1
+        base_price[buy] = grid_strategy.buy_price(base_price[buy], percent)
+
+        realized_pnl[sell] += (price[sell] - lot_prices[sell, lots[sell] - 1]) * quantities[sell]
+        lots[sell] -= 1
+        lot_prices[sell, lots[sell]] = np.nan
+        base_price[sell] = grid_strategy.sell_price(base_price[sell], percent)
+        base_price[base_change] = grid_strategy.sell_price(base_price[base_change], percent)
+
+        np.add.at(counts, (codes, np.arange(symbol_count)), 1)
+        buy_trades += len(bought)
+        for index in np.nonzero(codes)[0]:
+            trades.append((bars[bar], symbols[index], grid_strategy.ACTIONS[codes[index]], price[index]))
+
+    last_price = pd.DataFrame(prices).ffill().to_numpy()[-1] if bar_count else np.full(symbol_count, np.nan)
+    unrealized_pnl = np.nansum(last_price[:, None] - lot_prices, axis=1) * quantities
+    return {
+        "symbols": symbols,
+        "buy_trades": counts[grid_strategy.FIRST_BUY_CODE] + counts[grid_strategy.BUY_CODE],
+        "sell_trades": counts[grid_strategy.SELL_CODE],
+        "base_changes": counts[grid_strategy.BASE_CHANGE_CODE],
+        "realized_pnl": realized_pnl,
+        "unrealized_pnl": unrealized_pnl,
+        "lots": lots,
+        "base_price": base_price,
+        "trades": trades,
+    }
+
+
+def summary(result):
+    """Returns the per-symbol results as a DataFrame sorted by realized PnL"""
+    columns = ["buy_trades", "sell_trades", "base_changes", "realized_pnl", "unrealized_pnl", "lots", "base_price"]
+    table = pd.DataFrame({column: result[column] for column in columns}, index=result["symbols"])
+    return table.sort_values("realized_pnl", ascending=False)
+
+
+def random_walk_bars(symbol_count=110, days=250, bars_per_day=375, volatility=0.001, seed=0):
+    """Returns (days, prices) of synthetic minute bars, for timing the backtester without market data"""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, volatility, size=(days * bars_per_day, symbol_count))
+    prices = 1000 * np.exp(np.cumsum(steps, axis=0))
+    return np.repeat(np.arange(days), bars_per_day), prices
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        timestamps, symbols, prices, nifty = load_minute_bars(sys.argv[1])
+        days = pd.DatetimeIndex(timestamps).normalize().to_numpy()
+        quantities = [config.shares_quantity.get(symbol, 1) for symbol in symbols]
+    else:
+        timestamps, nifty, quantities = None, None, None
+        days, prices = random_walk_bars()
+        symbols = [f"SYMBOL{index}" for index in range(prices.shape[1])]
+    start = time.perf_counter()
+    result = backtest(prices, 3, quantities, days, nifty, symbols, timestamps)
+    elapsed = time.perf_counter() - start
+    print(summary(result).to_string())
+    print(f"Backtested {prices.shape[0]} bars x {prices.shape[1]} symbols in {elapsed:.2f} s, {len(result['trades'])} trades")
@@ -0,0 +1,452 @@
+"""
+Benchmarks of the trading hot paths, all run offline against stub clients and copies of the sheets.
+run_suite() runs every benchmark and writes the results as JSON, so versions can be compared:
+    python benchmark.py [output.json]
+"""
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from kiteconnect import KiteConnect
+from sqlmodel import create_engine
+import access_tokens
+import config
+import database
+import excel_functions
+import http_login
+import kite_stubs
+from fake_kite_server import FakeKiteServer
+from multiple_trading import GridEngine
+
+# config.rate_limits high enough that no benchmark waits on the rate limiter
+unlimited_rates = {"quote": 10 ** 6, "order": 10 ** 6, "other": 10 ** 6}
+
+
+@contextmanager
+def sheets_copy(user_ids):
+    """
+    Runs the block in a temporary working directory holding a copy of the users' sheets,
+    so benchmarks never modify the real 'Excel sheets' files.
+    """
+    source_dir = os.path.abspath("Excel sheets")
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(os.path.join(work_dir, "Excel sheets"))
+        for user_id in user_ids:
+            source = os.path.join(source_dir, user_id + ".xlsx")
+            if os.path.exists(source):
+                shutil.copy(source, os.path.join(work_dir, "Excel sheets"))
+        os.chdir(work_dir)
+        try:
+            yield work_dir
+        finally:
+            os.chdir(previous_dir)
+
+
+def timed(function, repeat=3):
+    """Returns the best wall time in seconds of repeat calls to function"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@contextmanager
+def quiet():
+    """Discards what the code under test prints, so the terminal output stays readable"""
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+def synthetic_state(symbols, lots=1, last_price=1000.0):
+    """Returns a load_user_state style dict holding symbols, each with lots lots at last_price"""
+    return {"symbols": list(symbols), "lots": dict.fromkeys(symbols, lots), "last_prices": dict.fromkeys(symbols, last_price),
+            "rows": {symbol: row for row, symbol in enumerate(symbols, start=2)},
+            "used_rows": set(range(2, len(symbols) + 2)), "access_token": None}
+
+
+def per_symbol_startup(user_id: str):
+    """Startup reads as multiple_trading did them: one workbook load per symbol lookup"""
+    excel_functions.get_access_token(user_id)
+    for symbol in excel_functions.read_symbols(user_id):
+        if excel_functions.get_last_price_for_symbol(user_id, symbol) is not None:
+            excel_functions.get_last_price_for_symbol(user_id, symbol)
+            excel_functions.get_lots_for_symbol(user_id, symbol)
+
+
+def benchmark_startup(user_id="UZ4820", repeat=3):
+    """Compares engine startup with per-symbol lookups against a single load_user_state pass"""
+    with sheets_copy([user_id]):
+        symbol_count = len(excel_functions.load_user_state(user_id)["symbols"])
+        per_symbol = timed(lambda: per_symbol_startup(user_id), repeat)
+        single_pass = timed(lambda: excel_functions.load_user_state(user_id), repeat)
+    print(f"{user_id}: Startup over {symbol_count} symbols")
+    print(f"  per-symbol lookups: {per_symbol:.3f} s")
+    print(f"  load_user_state:    {single_pass:.3f} s ({per_symbol / single_pass:.0f}x faster)")
+    return {"symbols": symbol_count, "per_symbol_seconds": per_symbol, "load_user_state_seconds": single_pass}
+
+
+@contextmanager
+def config_overrides(**settings):
+    """Temporarily replaces config settings for the duration of the block"""
+    previous = {name: getattr(config, name) for name in settings}
+    for name, value in settings.items():
+        setattr(config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(config, name, value)
+
+
+def benchmark_engines(account_counts=(1, 2, 4, 8, 16), cycles=20, template_user="UZ4820", percent=3):
+    """
+    Measures polling throughput with N GridEngines running side by side in one process,
+    one thread per engine, each trading template_user's symbols against its own StubKite.
+    Rate limits are lifted so the numbers show the engine cost rather than the API budget.
+    """
+    results = []
+    with sheets_copy([template_user]), config_overrides(push_order_updates=False, rate_limits=unlimited_rates):
+        template = excel_functions.load_user_state(template_user)
+        prices = {symbol: price for symbol, price in template["last_prices"].items() if price}
+        for count in account_counts:
+            engines = []
+            for index in range(count):
+                user_id = f"BENCH{index}"
+                excel_functions.create_excel_sheet(user_id)
+                kite = kite_stubs.StubKite(prices, seed=index)
+                state = excel_functions.UserState(user_id, loaded=template)
+                engine = GridEngine(kite, user_id, config.shares_quantity, "NSE", percent, state)
+                engine.start()
+                engines.append(engine)
+
+            def run_cycles(engine):
+                for _ in range(cycles):
+                    engine.step()
+
+            threads = [threading.Thread(target=run_cycles, args=(engine,)) for engine in engines]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            for engine in engines:
+                engine.stop()
+
+            symbols = sum(len(engine.trading_symbols) for engine in engines)
+            orders = sum(engine.kite.calls.get("place_order", 0) for engine in engines)
+            results.append({"accounts": count, "seconds": elapsed, "cycles_per_second": count * cycles / elapsed,
+                            "symbols_per_second": symbols * cycles / elapsed, "orders": orders})
+    print(f"Engine throughput over {cycles} cycles per account")
+    for result in results:
+        print(f"  {result['accounts']:>3} accounts: {result['cycles_per_second']:8.1f} cycles/s, "
+              f"{result['symbols_per_second']:10.0f} symbols/s, {result['orders']} orders")
+    return results
+
+
+def percentile(values, percent):
+    """Returns the value below which percent of values fall (nearest rank)"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0
+
+
+def benchmark_fake_server(accounts=10, symbols=1000, cycles=5, latency=0.02, jitter=0.01, error_rate=0.0, percent=3):
+    """
+    Load-tests the polling loop against a local FakeKiteServer: accounts GridEngines, each on its own thread
+    and KiteConnect client, trade symbols synthetic symbols for cycles cycles with the configured rate limits against Kite's.
+    Every symbol starts with one lot at the server's starting price. Reports cycle time percentiles and
+    the server's request outcomes, including 429s. Raises RuntimeError if any account's cycles failed.
+    """
+    universe = {f"SYM{index}": 1000.0 for index in range(symbols)}
+    loaded = synthetic_state(universe)
+    cycle_times = []
+    errors = []
+    times_lock = threading.Lock()
+    with sheets_copy([]), config_overrides(push_order_updates=False), \
+            FakeKiteServer(latency=latency, jitter=jitter, error_rate=error_rate, prices=universe) as server:
+        engines = []
+        for index in range(accounts):
+            user_id = f"LOAD{index}"
+            excel_functions.create_excel_sheet(user_id)
+            kite = KiteConnect(api_key=f"load_key_{index}", access_token="load_token", root=server.url)
+            state = excel_functions.UserState(user_id, loaded=loaded)
+            engine = GridEngine(kite, user_id, dict.fromkeys(universe, 1), "NSE", percent, state)
+            engine.start()
+            engines.append(engine)
+
+        def run_cycles(engine):
+            try:
+                for _ in range(cycles):
+                    cycle_start = time.perf_counter()
+                    engine.step()
+                    with times_lock:
+                        cycle_times.append(time.perf_counter() - cycle_start)
+            except Exception as e:
+                # An exception on a thread is only printed, so it is kept to fail the benchmark
+                with times_lock:
+                    errors.append((engine.user_id, e))
+
+        threads = [threading.Thread(target=run_cycles, args=(engine,)) for engine in engines]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        for engine in engines:
+            engine.stop()
+        stats = {name: dict(outcomes) for name, outcomes in server.stats.items()}
+
+    if errors:
+        for user_id, e in errors:
+            print(f"{user_id}: Load test cycle failed: {e!r}")
+        raise RuntimeError(f"Load test failed on {len(errors)} of {accounts} accounts") from errors[0][1]
+    result = {"accounts": accounts, "symbols": symbols, "seconds": elapsed,
+              "cycle_p50": percentile(cycle_times, 50), "cycle_p95": percentile(cycle_times, 95),
+              "cycle_max": max(cycle_times), "server": stats}
+    print(f"Load test: {accounts} accounts x {symbols} symbols, {cycles} cycles, {latency * 1000:.0f} ms latency")
+    print(f"  {elapsed:.1f} s total; cycle p50 {result['cycle_p50']:.3f} s, p95 {result['cycle_p95']:.3f} s, max {result['cycle_max']:.3f} s")
+    for name, outcomes in sorted(stats.items()):
+        print(f"  {name}: {outcomes}")
+    return result
+
+
+def benchmark_cycle(symbol_counts=(10, 100, 1000), cycles=10, percent=3):
+    """Times one GridEngine polling cycle (price snapshot, reconciliation and decisions) over N symbols against a StubKite"""
+    results = []
+    with sheets_copy([]), config_overrides(push_order_updates=False, rate_limits=unlimited_rates):
+        for count in symbol_counts:
+            symbols = [f"SYM{index}" for index in range(count)]
+            excel_functions.create_excel_sheet(f"CYCLE{count}")
+            kite = kite_stubs.StubKite(dict.fromkeys(symbols, 1000.0), seed=count)
+            state = excel_functions.UserState(f"CYCLE{count}", loaded=synthetic_state(symbols))
+            engine = GridEngine(kite, f"CYCLE{count}", dict.fromkeys(symbols, 1), "NSE", percent, state)
+            timings = []
+            with quiet():
+                engine.start()
+                for _ in range(cycles):
+                    start = time.perf_counter()
+                    engine.step()
+                    timings.append(time.perf_counter() - start)
+                engine.stop()
+            results.append({"symbols": count, "cycle_p50": percentile(timings, 50), "cycle_max": max(timings),
+                            "orders": kite.calls.get("place_order", 0)})
+    print(f"Polling cycle over {cycles} cycles")
+    for result in results:
+        print(f"  {result['symbols']:>5} symbols: p50 {result['cycle_p50'] * 1000:8.2f} ms, max {result['cycle_max'] * 1000:8.2f} ms")
+    return results
+
+
+def benchmark_excel(row_counts=(10, 100, 1000), repeat=3):
+    """Times upsert_symbol_row (update and insert), read_symbols and a UserState flush on sheets of growing size"""
+    results = []
+    with sheets_copy([]):
+        for count in row_counts:
+            user_id = f"EXCEL{count}"
+            with quiet():
+                excel_functions.create_excel_sheet(user_id)
+            file_name = "Excel sheets/" + user_id + ".xlsx"
+            wb = excel_functions.openpyxl.load_workbook(file_name)
+            for row in range(count):
+                wb[user_id].cell(row=row + 2, column=1, value=f"SYM{row}")
+                wb[user_id].cell(row=row + 2, column=2, value=1)
+                wb[user_id].cell(row=row + 2, column=3, value=1000.0)
+            wb.save(file_name)
+            inserted = iter(range(10 ** 6))
+            with quiet():
+                update = timed(lambda: excel_functions.upsert_symbol_row(user_id, f"SYM{count - 1}", 2, 990.0), repeat)
+                insert = timed(lambda: excel_functions.upsert_symbol_row(user_id, f"NEW{next(inserted)}", 1, 1000.0), repeat)
+                read = timed(lambda: excel_functions.read_symbols(user_id), repeat)
+                state = excel_functions.UserState(user_id, flush_interval=3600)
+
+                def flush_one_change():
+                    state.upsert(f"SYM{count - 1}", 3, 980.0)
+                    state.flush()
+                flush = timed(flush_one_change, repeat)
+                state.close()
+            results.append({"rows": count, "upsert_update": update, "upsert_insert": insert, "read_symbols": read, "user_state_flush": flush})
+    print("Excel sheet operations")
+    for result in results:
+        print(f"  {result['rows']:>5} rows: upsert update {result['upsert_update'] * 1000:7.1f} ms, insert {result['upsert_insert'] * 1000:7.1f} ms, "
+              f"read_symbols {result['read_symbols'] * 1000:7.1f} ms, UserState flush {result['user_state_flush'] * 1000:7.1f} ms")
+    return results
+
+
+def benchmark_database(row_counts=(100, 1000)):
+    """Measures database.update_data throughput for inserts and updates, on a temporary SQLite file"""
+    results = []
+    previous_engine = database.engine
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            for count in row_counts:
+                database.engine = create_engine(f"sqlite:///{os.path.join(work_dir, f'bench_{count}.db')}")
+                database.create_database()
+                start = time.perf_counter()
+                for index in range(count):
+                    database.update_data(f"SYM{index}", 1000.0, 1, 0)
+                inserts = time.perf_counter() - start
+                start = time.perf_counter()
+                for index in range(count):
+                    database.update_data(f"SYM{index}", 990.0, 2, 1.5)
+                updates = time.perf_counter() - start
+                database.engine.dispose()
+                results.append({"rows": count, "inserts_per_second": count / inserts, "updates_per_second": count / updates})
+        finally:
+            database.engine = previous_engine
+    print("database.update_data")
+    for result in results:
+        print(f"  {result['rows']:>6} rows: {result['inserts_per_second']:8.0f} inserts/s, {result['updates_per_second']:8.0f} updates/s")
+    return results
+
+
+@contextmanager
+def temporary_database(file_name):
+    """Points database.engine at a fresh SQLite file for the duration of the block"""
+    previous_engine = database.engine
+    database.engine = create_engine(f"sqlite:///{file_name}")
+    database.create_database()
+    try:
+        yield database.engine
+    finally:
+        database.engine.dispose()
+        database.engine = previous_engine
+
+
+def benchmark_database_bulk(row_counts=(100, 1000, 10000)):
+    """
+    Compares the per-row database functions with the bulk ones at growing row counts:
+    update_data vs bulk_update_data (insert, then update), get_data vs get_data_many,
+    and delete_all_data vs truncate_data.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in row_counts:
+            symbols = [f"SYM{index}" for index in range(count)]
+            result = {"rows": count}
+            with temporary_database(os.path.join(work_dir, f"per_row_{count}.db")):
+                result["per_row_insert"] = timed(lambda: [database.update_data(symbol, 1000.0, 1, 0) for symbol in symbols], 1)
+                result["per_row_update"] = timed(lambda: [database.update_data(symbol, 990.0, 2, 1.5) for symbol in symbols], 1)
+                result["per_row_get"] = timed(lambda: [database.get_data(symbol) for symbol in symbols], 1)
+                result["per_row_delete"] = timed(database.delete_all_data, 1)
+            with temporary_database(os.path.join(work_dir, f"bulk_{count}.db")):
+                result["bulk_insert"] = timed(lambda: database.bulk_update_data((symbol, 1000.0, 1, 0) for symbol in symbols), 1)
+                result["bulk_update"] = timed(lambda: database.bulk_update_data((symbol, 990.0, 2, 1.5) for symbol in symbols), 1)
+                result["bulk_get"] = timed(lambda: database.get_data_many(symbols), 1)
+                result["bulk_delete"] = timed(database.truncate_data, 1)
+            results.append(result)
+    print("database per-row vs bulk (seconds)")
+    for result in results:
+        print(f"  {result['rows']:>6} rows:")
+        for operation in ("insert", "update", "get", "delete"):
+            per_row, bulk = result[f"per_row_{operation}"], result[f"bulk_{operation}"]
+            print(f"    {operation:<7} per-row {per_row:8.3f}, bulk {bulk:8.4f} ({per_row / bulk:6.0f}x)")
+    return results
+
+
+def benchmark_reconciliation(order_counts=(10, 100, 1000), percent=3):
+    """
+    Times GridEngine.reconcile_open_orders over M open orders against a StubKite,
+    half of them complete and half still open, so they are cancelled and rolled back.
+    """
+    results = []
+    with sheets_copy([]), config_overrides(push_order_updates=False, rate_limits=unlimited_rates):
+        for count in order_counts:
+            symbols = [f"SYM{index}" for index in range(count)]
+            excel_functions.create_excel_sheet(f"RECON{count}")
+            kite = kite_stubs.StubKite(dict.fromkeys(symbols, 1000.0), seed=count)
+            state = excel_functions.UserState(f"RECON{count}", flush_interval=3600, loaded=synthetic_state(symbols, lots=2))
+            engine = GridEngine(kite, f"RECON{count}", dict.fromkeys(symbols, 1), "NSE", percent, state)
+            with quiet():
+                engine.load_trading_state()
+                for index, symbol in enumerate(symbols):
+                    order_id = kite.place_order(kite.VARIETY_REGULAR, "NSE", symbol, "BUY", 1, kite.PRODUCT_CNC, kite.ORDER_TYPE_LIMIT, 1000.0)
+                    if index % 2:
+                        kite._fill(kite.order_book[order_id])
+                    engine.open_order[symbol] = order_id
+                start = time.perf_counter()
+                engine.reconcile_open_orders()
+                elapsed = time.perf_counter() - start
+                state.close()
+            results.append({"orders": count, "seconds": elapsed, "kite_calls": sum(kite.calls.values()) - count})
+    print("Reconciliation of open orders")
+    for result in results:
+        print(f"  {result['orders']:>5} orders: {result['seconds'] * 1000:8.1f} ms, {result['kite_calls']} Kite calls")
+    return results
+
+
+def benchmark_token_startup(user_id="UZ4820", repeat=5):
+    """
+    Times getting a working client at startup against a local FakeKiteServer:
+    reading the stored token from the sheet and checking it with profile(), logging in over HTTP
+    to get a request token, and exchanging a request token for a new one with generate_session.
+    The browser login is not included.
+    """
+    with sheets_copy([user_id]), FakeKiteServer(rate_limits=None) as server:
+        def reuse_stored_token():
+            kite = KiteConnect(api_key="bench_key", root=server.url)
+            access_tokens.ensure_access_token(kite, user_id, excel_functions.load_user_state(user_id)["access_token"] or "bench_token")
+
+        def exchange_request_token():
+            kite = KiteConnect(api_key="bench_key", root=server.url)
+            kite.generate_session("bench_request_token", api_secret="bench_secret")
+
+        def http_login_request_token():
+            http_login.get_request_token(user_id, login_url=server.url + "/connect/login?api_key=bench_key&v=3")
+        with quiet(), config_overrides(totp_min_validity=0):
+            reuse = timed(reuse_stored_token, repeat)
+            login = timed(http_login_request_token, repeat)
+            exchange = timed(exchange_request_token, repeat)
+    print("Token startup")
+    print(f"  stored token + profile check: {reuse * 1000:.1f} ms")
+    print(f"  HTTP login to request token:  {login * 1000:.1f} ms")
+    print(f"  request token exchange:       {exchange * 1000:.1f} ms")
+    return {"stored_token_check": reuse, "http_login": login, "session_exchange": exchange}
+
+
+def git_commit():
+    """Returns the short hash of the checked out commit, or None outside a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(output="benchmark_results.json"):
+    """Runs every benchmark and writes the results, with the commit and machine they ran on, to output as JSON"""
+    results = {
+        "commit": git_commit(),
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+    results["startup"] = benchmark_startup("UZ4820")
+    results["cycle"] = benchmark_cycle()
+    results["excel"] = benchmark_excel()
+    results["database"] = benchmark_database()
+    results["database_bulk"] = benchmark_database_bulk()
+    results["reconciliation"] = benchmark_reconciliation()
+    results["token_startup"] = benchmark_token_startup()
+    with quiet():
+        results["engines"] = benchmark_engines(cycles=5)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    run_suite(sys.argv[1] if len(sys.argv) > 1 else "benchmark_results.json")
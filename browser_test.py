@@ -37,11 +37,8 @@ def wait_for_url_change(driver, old_url, max_retries=3, wait_time=10):
     return False
 
 
-def generate_automated_access_token(user_id):
-
-    link = generate_access_token.print_url(user_id)
-
-    # Chrome options
+def chrome_options():
+    """Options of the headless Chrome used for logins"""
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
@@ -50,27 +47,37 @@ def generate_automated_access_token(user_id):
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
     options.add_argument("--incognito")
-    
-    driver = webdriver.Chrome(options=options)
+    return options
+
+
+def login_with_driver(driver, user_id, deadline=None):
+    """
+    Logs the user in to Kite in an already running Chrome.
+    Returns the new access token, or None if the login failed or time.monotonic() passed deadline.
+    """
+    link = generate_access_token.print_url(user_id)
     driver.get(link)
 
     if not wait_for_element(driver, By.ID, "userid", description="User ID field"):
-        driver.quit(); return
+        return
 
     driver.find_element(By.ID, "userid").send_keys(user_id)
 
     secret = None
     while secret is None:
+        if deadline is not None and time.monotonic() > deadline:
+            print(f"{user_id}: ❌ Login deadline passed.")
+            return
         if not wait_for_element(driver, By.ID, "password", description="Password field"):
-            driver.quit(); return
+            return
         if not wait_for_element(driver, By.CLASS_NAME, "button-orange.wide", description="Login Button"):
-            driver.quit(); return
+            return
 
         driver.find_element(By.ID, "password").send_keys(config.config_keys[user_id]["password"])
         driver.find_element(By.CLASS_NAME, "button-orange.wide").submit()
 
         if not wait_for_element(driver, By.ID, "userid", description="Token field (2FA)"):
-            driver.quit(); return
+            return
 
         token = otp_test.run_parser(config.config_keys[user_id]["qr_link"])
         print(f"{user_id}: Token: {token}")
@@ -86,7 +93,7 @@ def generate_automated_access_token(user_id):
             token_field.send_keys(Keys.BACKSPACE)       # Delete existing content
             token_field.send_keys(str(token))           # Send token
         except Exception as e:
-            print("{user_id}: ❌ Could not send token to token field:", e)
+            print(f"{user_id}: ❌ Could not send token to token field:", e)
             driver.save_screenshot("token_input_error.png")
             continue
 
@@ -99,5 +106,13 @@ def generate_automated_access_token(user_id):
         secret = query_params.get("request_token", [None])[0]
 
     print(f"{user_id}: Secret: {secret}")
-    generate_access_token.generate_access_token(user_id, secret)
-    driver.quit()
+    return generate_access_token.generate_access_token(user_id, secret)
+
+
+def generate_automated_access_token(user_id):
+    """Logs the user in to Kite with headless Chrome. Returns the new access token, or None if the login failed."""
+    driver = webdriver.Chrome(options=chrome_options())
+    try:
+        return login_with_driver(driver, user_id)
+    finally:
+        driver.quit()
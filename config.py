@@ -2,6 +2,52 @@
 ID = ["UZ4820", "QAR613", "PQU213"] 
 # file_name = "Excel sheets/" + ID + ".xlsx"
 
+# "poll" polls prices every cycle, "ticks" trades on the KiteTicker streaming feed, both with a thread per account;
+# "async" polls every account on one asyncio event loop (async_trading.py), which does not use push_order_updates
+trading_mode = "poll"
+# Apply order updates pushed on the KiteTicker connection as they arrive instead of waiting for reconciliation
+push_order_updates = True
+# Seconds a cached response stays valid in kite_functions, per endpoint
+cache_ttl = {"quote": 5, "holdings": 60, "positions": 10}
+# Kite API requests per second Kite allows each account: quote/ltp, order placement/cancellation, everything else
+kite_rate_limits = {"quote": 1, "order": 10, "other": 10}
+# Requests per second the engine sends for each account, 0.8 times kite_rate_limits, so requests delayed on the
+# way to Kite do not arrive bunched up past its limit and come back with a 429
+rate_limits = {"quote": 0.8, "order": 8, "other": 8}
+# Seconds between the starts of two polling cycles; also how long a new order has to fill before reconciliation
+cycle_interval = 10
+# Order book reads after cancelling unfilled orders, and seconds between them, while waiting for every cancelled order to reach
+# a final status; an order still open after the last read is checked again at the next reconciliation
+cancel_poll_attempts = 3
+cancel_poll_interval = 0.5
+# Where the engine keeps lots, last prices, trade summaries and access tokens: "excel" (Excel sheets) or "sqlite" (state_db)
+state_backend = "excel"
+state_db = "trading_state.db"
+# Write the Excel state at the end of every cycle instead of every 30 seconds; supervisor.py workers always do,
+# so a killed worker loses at most one cycle of state
+flush_state_every_cycle = False
+# supervisor.py: accounts traded by each worker process, seconds between worker heartbeats,
+# seconds without a heartbeat before a worker is restarted, and restarts allowed per worker in a day
+accounts_per_worker = 1
+heartbeat_interval = 5
+heartbeat_timeout = 60
+max_restarts = 5
+# Record per-endpoint Kite API metrics (kite_metrics.py) and dump them in Prometheus text format every metrics_interval seconds
+kite_metrics = True
+metrics_file = "kite_metrics.prom"
+metrics_interval = 60
+# reports.py: directory of the trade reports, one file per "day" or "month", and the formats written ("xlsx", "csv", "parquet")
+report_dir = "reports"
+report_partition = "month"
+report_formats = ("xlsx",)
+# otp_test.py: a TOTP code valid for less than this many seconds is not used; the next 30 second window is waited for
+totp_min_validity = 5
+# How accounts log in: "http" (http_login.py, falling back to the browser if it fails) or "browser" (headless Chrome)
+login_mode = "http"
+# login_pool.py: headless Chrome instances shared by concurrent logins and the seconds all logins may take together
+login_browsers = 2
+login_deadline = 180
+
 config_keys = {
     "UZ4820": {
         "password": "sand7971@",
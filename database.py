@@ -1,8 +1,13 @@
-from sqlmodel import SQLModel, create_engine, Session, select, Field
+from sqlmodel import SQLModel, create_engine, Session, select, Field, col, delete
+from sqlalchemy import event, func, text
+from sqlalchemy.dialects.sqlite import insert
 import kite_functions
 import openpyxl
 from datetime import datetime
 import os
+import threading
+import config
+import excel_functions
 
 
 class TradingData(SQLModel, table=True):
@@ -16,13 +21,50 @@ sqlite_file_name = "trading_data.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 engine = create_engine(sqlite_url)
 # extend_existing = True
+# Rows per multi-row statement of the bulk functions, keeping the bound values under SQLite's limit of 32766
+BULK_CHUNK = 5000
+
+
+class PnlTotal(SQLModel, table=True):
+    """Single row holding the sum of the rounded PnL of all TradingData rows, kept current by triggers"""
+    id: int = Field(default=1, primary_key=True)
+    total: float = 0
+    __table_args__ = {'extend_existing': True}
+
+
+# Every insert, update and delete of a TradingData row adjusts the running total in the same transaction
+pnl_total_triggers = [
+    """CREATE TRIGGER IF NOT EXISTS pnl_total_insert AFTER INSERT ON tradingdata
+       BEGIN UPDATE pnltotal SET total = total + ROUND(NEW.pnl, 2) WHERE id = 1; END""",
+    """CREATE TRIGGER IF NOT EXISTS pnl_total_update AFTER UPDATE OF pnl ON tradingdata
+       BEGIN UPDATE pnltotal SET total = total - ROUND(OLD.pnl, 2) + ROUND(NEW.pnl, 2) WHERE id = 1; END""",
+    """CREATE TRIGGER IF NOT EXISTS pnl_total_delete AFTER DELETE ON tradingdata
+       BEGIN UPDATE pnltotal SET total = total - ROUND(OLD.pnl, 2) WHERE id = 1; END""",
+]
+# URLs of the databases create_pnl_total has run on in this process
+pnl_total_ready = set()
+
+
+def create_pnl_total():
+    """
+    Creates the running PnL total and its triggers if the database does not have them yet,
+    starting the total from the rows already stored. Safe to call on every start.
+    """
+    SQLModel.metadata.create_all(engine, tables=[TradingData.__table__, PnlTotal.__table__])
+    with engine.begin() as connection:
+        for trigger in pnl_total_triggers:
+            connection.execute(text(trigger))
+        connection.execute(text("INSERT OR IGNORE INTO pnltotal (id, total) SELECT 1, COALESCE(SUM(ROUND(pnl, 2)), 0) FROM tradingdata"))
+    pnl_total_ready.add(str(engine.url))
 
 
 def create_database():
     SQLModel.metadata.create_all(engine)
+    create_pnl_total()
 
 def delete_database():
     SQLModel.metadata.drop_all(engine)
+    pnl_total_ready.discard(str(engine.url))
 
 def update_data(tradingsymbol: str, last_price: float, number_of_trades: int, pnl: float):
     with Session(engine) as session:
@@ -40,6 +82,56 @@ def update_data(tradingsymbol: str, last_price: float, number_of_trades: int, pn
         session.commit()
 
 
+def bulk_upsert(session, model, rows, key_columns, update_values):
+    """
+    Inserts rows (a list of dicts) into the table of model with multi-row INSERT ... ON CONFLICT DO UPDATE
+    statements of up to BULK_CHUNK rows. update_values maps each column to update on conflict to a function
+    of the `excluded` row, i.e. the values that were being inserted.
+    """
+    table = model.__table__
+    for start in range(0, len(rows), BULK_CHUNK):
+        statement = insert(table).values(rows[start:start + BULK_CHUNK])
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: value(statement.excluded) for column, value in update_values.items()})
+        session.exec(statement)
+
+
+def bulk_update_data(rows):
+    """
+    Same as update_data for many symbols at once: rows is an iterable of
+    (tradingsymbol, last_price, number_of_trades, pnl). All rows are written in one transaction.
+    """
+    rows = [{"tradingsymbol": tradingsymbol, "last_price": last_price, "number_of_trades": number_of_trades, "pnl": pnl}
+            for tradingsymbol, last_price, number_of_trades, pnl in rows]
+    with Session(engine) as session:
+        bulk_upsert(session, TradingData, rows, ["tradingsymbol"], {
+            "last_price": lambda excluded: excluded.last_price,
+            "number_of_trades": lambda excluded: excluded.number_of_trades,
+            # Existing rows accumulate the PnL, as update_data does
+            "pnl": lambda excluded: TradingData.__table__.c.pnl + func.round(excluded.pnl, 2),
+        })
+        session.commit()
+
+
+def get_data_many(tradingsymbols):
+    """Returns {tradingsymbol: TradingData} for the given symbols that exist, with one IN query per BULK_CHUNK symbols"""
+    tradingsymbols = list(tradingsymbols)
+    result = {}
+    with Session(engine) as session:
+        for start in range(0, len(tradingsymbols), BULK_CHUNK):
+            statement = select(TradingData).where(col(TradingData.tradingsymbol).in_(tradingsymbols[start:start + BULK_CHUNK]))
+            result.update((row.tradingsymbol, row) for row in session.exec(statement).all())
+    return result
+
+
+def truncate_data():
+    """Deletes every TradingData row with a single DELETE statement"""
+    with Session(engine) as session:
+        session.exec(delete(TradingData))
+        session.commit()
+
+
 def get_data(tradingsymbol: str):
     with Session(engine) as session:
         statement = select(TradingData).where(TradingData.tradingsymbol == tradingsymbol)
@@ -76,6 +168,24 @@ def get_all_data():
         else:
             return None
 
+def iter_all_data(page_size=500):
+    """
+    Yields every TradingData row in symbol order, reading page_size rows at a time,
+    so callers never hold the whole table in memory.
+    """
+    last_symbol = None
+    while True:
+        with Session(engine) as session:
+            statement = select(TradingData).order_by(TradingData.tradingsymbol).limit(page_size)
+            if last_symbol is not None:
+                statement = statement.where(TradingData.tradingsymbol > last_symbol)
+            page = session.exec(statement).all()
+        if not page:
+            return
+        yield from page
+        last_symbol = page[-1].tradingsymbol
+
+
 def delete_file(file_path):
     """Function to delete a file"""
     try:
@@ -98,8 +208,237 @@ def delete_all_data():
         else:
             return None
 
+# Per-user engine state, used in place of the Excel sheets when config.state_backend is "sqlite"
+class SymbolState(SQLModel, table=True):
+    user_id: str = Field(primary_key=True)
+    tradingsymbol: str = Field(primary_key=True)
+    lots: int | None = None
+    last_price: float | None = None
+    position: int = 0       # Order of the symbol, like its row in the sheet
+    __table_args__ = {'extend_existing': True}
+
+
+class TradeSummary(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    user_id: str = Field(index=True)
+    date: str
+    buy_trades: int
+    sell_trades: int
+    base_change: int
+    approximate_profit: float
+    __table_args__ = {'extend_existing': True}
+
+
+class AccessToken(SQLModel, table=True):
+    user_id: str = Field(primary_key=True)
+    access_token: str
+    updated: str
+    __table_args__ = {'extend_existing': True}
+
+
+state_tables = [SymbolState.__table__, TradeSummary.__table__, AccessToken.__table__]
+state_engine = create_engine(f"sqlite:///{config.state_db}", connect_args={"check_same_thread": False, "timeout": 30})
+
+
+@event.listens_for(state_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run while a cycle is being written; NORMAL sync is safe with WAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_state_tables():
+    SQLModel.metadata.create_all(state_engine, tables=state_tables)
+
+
+def load_user_state(user_id: str):
+    """
+    Reads the user's symbols, lots, last prices and access token in one session.
+    Returns the same dict as excel_functions.load_user_state, with positions in place of row numbers.
+    """
+    create_state_tables()
+    with Session(state_engine) as session:
+        rows = session.exec(select(SymbolState).where(SymbolState.user_id == user_id).order_by(SymbolState.position)).all()
+        token = session.get(AccessToken, user_id)
+    state = {"symbols": [], "lots": {}, "last_prices": {}, "rows": {}, "used_rows": set(),
+             "access_token": token.access_token if token else None}
+    for row in rows:
+        state["symbols"].append(row.tradingsymbol)
+        state["lots"][row.tradingsymbol] = row.lots
+        state["last_prices"][row.tradingsymbol] = row.last_price
+        state["rows"][row.tradingsymbol] = row.position
+        state["used_rows"].add(row.position)
+    return state
+
+
+class SqliteUserState:
+    """
+    In-memory copy of a user's SymbolState rows with the same interface as excel_functions.UserState.
+    Updates only touch memory; end_cycle() writes every row changed in the cycle in a single transaction.
+    """
+    def __init__(self, user_id: str, loaded=None):
+        self.user_id = user_id
+        self.rows = {}          # symbol -> [lots, last price]
+        self.row_index = {}     # symbol -> position
+        self.dirty = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        create_state_tables()
+        loaded = loaded if loaded is not None else load_user_state(user_id)
+        for symbol in loaded["symbols"]:
+            self.rows[symbol] = [loaded["lots"][symbol], loaded["last_prices"][symbol]]
+            self.row_index[symbol] = loaded["rows"][symbol]
+        self._next_position = max(self.row_index.values(), default=0) + 1
+
+    def symbols(self):
+        """Returns the symbols in position order"""
+        return sorted(self.rows, key=self.row_index.get)
+
+    def get_lots(self, symbol):
+        row = self.rows.get(symbol)
+        return row[0] if row else None
+
+    def get_last_price(self, symbol):
+        row = self.rows.get(symbol)
+        return row[1] if row else None
+
+    def upsert(self, symbol, lots, last_price):
+        """Updates the lots and last price of a symbol in memory, adding it after the last one if it is new"""
+        symbol = str(symbol).strip()
+        with self._lock:
+            if symbol not in self.row_index:
+                self.row_index[symbol] = self._next_position
+                self._next_position += 1
+            self.rows[symbol] = [lots, last_price]
+            self.dirty.add(symbol)
+
+    def flush(self):
+        """Writes all rows changed since the last flush in one transaction"""
+        with self._write_lock:
+            with self._lock:
+                changes = {symbol: (self.row_index[symbol], *self.rows[symbol]) for symbol in self.dirty}
+                self.dirty.clear()
+            if not changes:
+                return
+            rows = [{"user_id": self.user_id, "tradingsymbol": symbol, "lots": lots, "last_price": last_price, "position": position}
+                    for symbol, (position, lots, last_price) in changes.items()]
+            try:
+                with Session(state_engine) as session:
+                    bulk_upsert(session, SymbolState, rows, ["user_id", "tradingsymbol"], {
+                        "lots": lambda excluded: excluded.lots,
+                        "last_price": lambda excluded: excluded.last_price,
+                        "position": lambda excluded: excluded.position,
+                    })
+                    session.commit()
+            except Exception as e:
+                # Keep the rows dirty so the next flush retries them
+                with self._lock:
+                    self.dirty.update(changes)
+                print(f"{self.user_id}: Failed to save state to '{config.state_db}': {str(e)}")
+
+    def end_cycle(self):
+        """Called by the engine at the end of every cycle to commit the cycle's changes"""
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+def append_trade_summary(user_id: str, buy_trades, sell_trades, base_change):
+    """Stores the day's trade counts of the user, as excel_functions.append_trading_orders does in the sheet"""
+    create_state_tables()
+    with Session(state_engine) as session:
+        session.add(TradeSummary(user_id=user_id, date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), buy_trades=buy_trades,
+                                 sell_trades=sell_trades, base_change=base_change, approximate_profit=(base_change + sell_trades) * 40))
+        session.commit()
+    print(f"{user_id}: Trade summary stored in '{config.state_db}'.")
+
+
+def get_access_token(user_id: str):
+    create_state_tables()
+    with Session(state_engine) as session:
+        token = session.get(AccessToken, user_id)
+        return token.access_token if token else None
+
+
+def set_access_token(user_id: str, token):
+    create_state_tables()
+    with Session(state_engine) as session:
+        session.merge(AccessToken(user_id=user_id, access_token=token, updated=datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        session.commit()
+
+
+def import_trade_summaries(user_id: str):
+    """
+    Copies the trade summary table (columns E-I) of the user's sheet into TradeSummary, skipping the
+    days already stored, so importing twice does not duplicate them. Returns the number of rows added.
+    """
+    create_state_tables()
+    added = 0
+    with Session(state_engine) as session:
+        stored = {(summary.date, summary.buy_trades, summary.sell_trades, summary.base_change)
+                  for summary in session.exec(select(TradeSummary).where(TradeSummary.user_id == user_id)).all()}
+        for date, buy_trades, sell_trades, base_change, approximate_profit in excel_functions.read_trading_orders(user_id):
+            date = date.strftime("%Y-%m-%d %H:%M:%S") if isinstance(date, datetime) else str(date)
+            buy_trades, sell_trades, base_change = buy_trades or 0, sell_trades or 0, base_change or 0
+            if (date, buy_trades, sell_trades, base_change) in stored:
+                continue
+            if approximate_profit is None:
+                approximate_profit = (base_change + sell_trades) * 40
+            session.add(TradeSummary(user_id=user_id, date=date, buy_trades=buy_trades, sell_trades=sell_trades,
+                                     base_change=base_change, approximate_profit=approximate_profit))
+            added += 1
+        session.commit()
+    return added
+
+
+def import_user_from_excel(user_id: str):
+    """Copies the symbols, lots, last prices, trade summaries and access token of the user's sheet into the state database"""
+    loaded = excel_functions.load_user_state(user_id)
+    state = SqliteUserState(user_id, loaded={**loaded, "symbols": [], "rows": {}})
+    for symbol in loaded["symbols"]:
+        state.upsert(symbol, loaded["lots"][symbol], loaded["last_prices"][symbol])
+    state.flush()
+    summaries = import_trade_summaries(user_id)
+    if loaded["access_token"]:
+        set_access_token(user_id, loaded["access_token"])
+    print(f"{user_id}: Imported {len(loaded['symbols'])} symbols and {summaries} trade summaries from the sheet into '{config.state_db}'.")
+
+
+def export_user_to_excel(user_id: str):
+    """
+    Writes the user's state from the database to 'Excel sheets/<user>.xlsx' in the sheet layout:
+    symbols in columns A-C, the trade summaries in E-I and the access token in K2.
+    """
+    excel_functions.create_excel_sheet(user_id)
+    file_name = "Excel sheets/" + user_id + ".xlsx"
+    state = load_user_state(user_id)
+    with Session(state_engine) as session:
+        summaries = session.exec(select(TradeSummary).where(TradeSummary.user_id == user_id).order_by(TradeSummary.date, TradeSummary.id)).all()
+    wb = openpyxl.load_workbook(file_name)
+    ws = wb[user_id]
+    for row in ws.iter_rows(min_row=2, max_col=11):
+        for cell in row:
+            cell.value = None
+    for row_num, symbol in enumerate(state["symbols"], start=2):
+        ws.cell(row=row_num, column=1, value=symbol)
+        ws.cell(row=row_num, column=2, value=state["lots"][symbol])
+        ws.cell(row=row_num, column=3, value=state["last_prices"][symbol])
+    for row_num, summary in enumerate(summaries, start=2):
+        for column, value in enumerate([summary.date, summary.buy_trades, summary.sell_trades, summary.base_change, summary.approximate_profit], start=5):
+            ws.cell(row=row_num, column=column, value=value)
+    ws.cell(row=2, column=11, value=state["access_token"])
+    wb.save(file_name)
+    print(f"{user_id}: Exported {len(state['symbols'])} symbols and {len(summaries)} trade summaries to '{file_name}'.")
+
+
 def feed_database_in_excel():
-    """Function to log the order details to an Excel file"""
+    """
+    Function to log the order details to an Excel file.
+    trades_data.xlsx is loaded and saved in full, so this gets slower every day; reports.export_report writes bounded partitions.
+    """
     file_path = 'trades_data.xlsx'
     try:
         workbook = openpyxl.load_workbook(file_path)
@@ -111,21 +450,36 @@ def feed_database_in_excel():
     sheet.append(["", "", ""])
     sheet.append(["Date - ", "", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
     sheet.append(["Symbol", "Quantity", "Last Price", "PnL"])
-    total_pnl = 0
-    trading_data = get_all_data()
-    for data in trading_data:
-        total_pnl += round(data.pnl, 2)
+    for data in iter_all_data():
         sheet.append([data.tradingsymbol, data.number_of_trades, round(data.last_price, 2), round(data.pnl, 2)])
-    sheet.append(["Total", "", "", round(total_pnl, 2)])
+    sheet.append(["Total", "", "", get_total_pnl()])
     workbook.save(file_path)        
 
 def get_total_pnl():
-    """Function to get the total PnL"""
-    total_pnl = 0
-    trading_data = get_all_data()
-    for data in trading_data:
-        total_pnl += round(data.pnl, 2)
-    return total_pnl
+    """Function to get the total PnL, read from the running total instead of summing every row"""
+    if str(engine.url) not in pnl_total_ready:
+        create_pnl_total()
+    with Session(engine) as session:
+        return round(session.get(PnlTotal, 1).total, 2)
+
+
+def sum_pnl():
+    """Returns the total PnL computed by SQLite over all rows, e.g. to check the running total"""
+    with Session(engine) as session:
+        return round(session.exec(select(func.coalesce(func.sum(func.round(TradingData.pnl, 2)), 0))).one(), 2)
+
+
+def get_pnl_summary():
+    """Returns the number of symbols, total trades, total PnL and the number of symbols in profit and in loss in one query"""
+    with Session(engine) as session:
+        symbols, trades, total, winners, losers = session.exec(select(
+            func.count(),
+            func.coalesce(func.sum(TradingData.number_of_trades), 0),
+            func.coalesce(func.sum(func.round(TradingData.pnl, 2)), 0),
+            func.count().filter(TradingData.pnl > 0),
+            func.count().filter(TradingData.pnl < 0),
+        )).one()
+    return {"symbols": symbols, "trades": trades, "total_pnl": round(total, 2), "winners": winners, "losers": losers}
 
 if __name__ == '__main__':
     # create_database()
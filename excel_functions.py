@@ -1,5 +1,6 @@
 import openpyxl
 import config
+import threading
 from datetime import datetime
 
 
@@ -125,6 +126,150 @@ def upsert_symbol_row(user_id, symbol, lots, last_price):
 
     wb.save(file_name)
 
+def load_user_state(user_id: str):
+    """
+    Reads everything the engine needs at startup from the user's sheet in a single read-only pass.
+    Returns a dict with:
+      - "symbols": symbols in sheet order
+      - "lots" / "last_prices": {symbol: value}
+      - "rows": {symbol: row number}, "used_rows": row numbers with data in the first table
+      - "access_token": the stored access token or None
+    """
+    file_name = "Excel sheets/" + user_id + ".xlsx"
+    table1_headers = ("Symbol", "Lots", "Last Price")
+    table2_headers = ("Date", "Buy Trades", "Sell Trades", "Base Change", "Approximate Profit")
+    try:
+        wb = openpyxl.load_workbook(file_name, read_only=True)
+    except FileNotFoundError:
+        wb = None
+    headers_ok = False
+    if wb is not None and user_id in wb.sheetnames:
+        header_row = tuple(next(wb[user_id].iter_rows(max_row=1, max_col=11, values_only=True), ()))
+        # Same layout as create_excel_sheet: table 1 in A-C, the trade summary in E-I and the access token in K
+        headers_ok = len(header_row) == 11 and header_row[:3] == table1_headers and header_row[4:9] == table2_headers and header_row[10] == "Access Token"
+    if not headers_ok:
+        if wb is not None:
+            # Closed before create_excel_sheet rewrites the file, which Windows refuses while it is open
+            wb.close()
+        create_excel_sheet(user_id)
+        wb = openpyxl.load_workbook(file_name, read_only=True)
+    ws = wb[user_id]
+
+    state = {"symbols": [], "lots": {}, "last_prices": {}, "rows": {}, "used_rows": set(), "access_token": None}
+    for row_num, row in enumerate(ws.iter_rows(min_row=2, max_col=11, values_only=True), start=2):
+        if row_num == 2 and len(row) >= 11 and row[10]:
+            state["access_token"] = row[10]
+        symbol_row = row[:3]
+        if any(cell is not None and cell != "" for cell in symbol_row):
+            state["used_rows"].add(row_num)
+        if symbol_row and symbol_row[0]:
+            symbol = str(symbol_row[0]).strip()
+            state["symbols"].append(symbol)
+            state["lots"][symbol] = symbol_row[1] if len(symbol_row) > 1 else None
+            state["last_prices"][symbol] = symbol_row[2] if len(symbol_row) > 2 else None
+            state["rows"][symbol] = row_num
+    wb.close()
+    return state
+
+
+class UserState:
+    """
+    In-memory copy of the Symbol/Lots/Last Price table of a user's sheet, indexed by symbol.
+    Updates only touch memory; changed rows are coalesced and written to 'Excel sheets/<user>.xlsx'
+    by a background writer every flush_interval seconds, and on flush() / close(); with flush_every_cycle
+    also at the end of every engine cycle.
+    """
+    def __init__(self, user_id: str, flush_interval=30, loaded=None, flush_every_cycle=False):
+        self.user_id = user_id
+        self.file_name = "Excel sheets/" + user_id + ".xlsx"
+        self.flush_interval = flush_interval
+        self.flush_every_cycle = flush_every_cycle
+        self.rows = {}          # symbol -> [lots, last price]
+        self.row_index = {}     # symbol -> row number in the sheet
+        self.dirty = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._load(loaded if loaded is not None else load_user_state(user_id))
+        self._writer = threading.Thread(target=self._write_behind, name=f"{user_id}-state-writer", daemon=True)
+        self._writer.start()
+
+    def _load(self, loaded):
+        for symbol in loaded["symbols"]:
+            self.rows[symbol] = [loaded["lots"][symbol], loaded["last_prices"][symbol]]
+            self.row_index[symbol] = loaded["rows"][symbol]
+        self._used_rows = set(loaded["used_rows"])
+        self._next_row = 2
+
+    def _free_row(self):
+        while self._next_row in self._used_rows:
+            self._next_row += 1
+        self._used_rows.add(self._next_row)
+        return self._next_row
+
+    def symbols(self):
+        """Returns the symbols in sheet order"""
+        return sorted(self.rows, key=self.row_index.get)
+
+    def get_lots(self, symbol):
+        row = self.rows.get(symbol)
+        return row[0] if row else None
+
+    def get_last_price(self, symbol):
+        row = self.rows.get(symbol)
+        return row[1] if row else None
+
+    def upsert(self, symbol, lots, last_price):
+        """
+        Updates the lots and last price of a symbol in memory, adding it after the last row if it is new.
+        The change is written to the sheet by the next flush.
+        """
+        symbol = str(symbol).strip()
+        with self._lock:
+            if symbol not in self.row_index:
+                self.row_index[symbol] = self._free_row()
+            self.rows[symbol] = [lots, last_price]
+            self.dirty.add(symbol)
+
+    def flush(self):
+        """Writes all rows changed since the last flush to the sheet with a single load and save"""
+        with self._write_lock:
+            with self._lock:
+                changes = {symbol: (self.row_index[symbol], *self.rows[symbol]) for symbol in self.dirty}
+                self.dirty.clear()
+            if not changes:
+                return
+            try:
+                wb = openpyxl.load_workbook(self.file_name)
+                ws = wb[self.user_id]
+                for symbol, (row_num, lots, last_price) in changes.items():
+                    ws.cell(row=row_num, column=1, value=symbol)
+                    ws.cell(row=row_num, column=2, value=lots)
+                    ws.cell(row=row_num, column=3, value=last_price)
+                wb.save(self.file_name)
+            except Exception as e:
+                # Keep the rows dirty so the next flush retries them
+                with self._lock:
+                    self.dirty.update(changes)
+                print(f"{self.user_id}: Failed to save state to '{self.file_name}': {str(e)}")
+
+    def end_cycle(self):
+        """Called by the engine at the end of every cycle; writes the cycle's changes if flush_every_cycle is set"""
+        if self.flush_every_cycle:
+            self.flush()
+
+    def _write_behind(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stops the background writer and writes any pending changes"""
+        self._stop.set()
+        if self._writer.is_alive() and self._writer is not threading.current_thread():
+            self._writer.join()
+        self.flush()
+
+
 def delete_all_data(user_id: str):
     """
     Deletes all data from the sheet in 'multiple_trading_sheet.xlsx'.
@@ -161,6 +306,21 @@ def read_symbols(user_id: str):
     return symbols
 
 
+def next_trading_orders_row(file_name: str, sheet_name: str):
+    """
+    Returns the row after the last one with a value in columns E-H (second table), found in a read-only pass:
+    iter_rows on a writable worksheet creates every cell it visits, which would then be saved with the sheet.
+    """
+    wb = openpyxl.load_workbook(file_name, read_only=True)
+    try:
+        last_row = 1
+        for row_num, values in enumerate(wb[sheet_name].iter_rows(min_row=2, min_col=5, max_col=8, values_only=True), start=2):
+            if any(value is not None and value != "" for value in values):
+                last_row = row_num
+        return last_row + 1
+    finally:
+        wb.close()
+
 def append_trading_orders(user_id: str, buy_trades, sell_trades, base_change):
     """
     Appends a new trading order with the current date, buy trades, sell trades, and base change
@@ -170,17 +330,10 @@ def append_trading_orders(user_id: str, buy_trades, sell_trades, base_change):
     file_name = "Excel sheets/" + user_id + ".xlsx"
     sheet_name = user_id
 
+    row_num = next_trading_orders_row(file_name, sheet_name)
     wb = openpyxl.load_workbook(file_name)
     ws = wb[sheet_name]
 
-    # Find the first empty row in columns E-H (second table)
-    row_num = 2
-    while True:
-        # If all columns E-H are empty, this is our row
-        if not any(ws.cell(row=row_num, column=col).value for col in range(5, 9)):
-            break
-        row_num += 1
-
     # Write values in their respective columns: Date (E), Buy Trades (F), Sell Trades (G), Base Change (H)
     ws.cell(row=row_num, column=5, value=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     ws.cell(row=row_num, column=6, value=buy_trades)
@@ -191,6 +344,20 @@ def append_trading_orders(user_id: str, buy_trades, sell_trades, base_change):
     wb.save(file_name)
     print(f"New trading orders appended to '{sheet_name}' in '{file_name}' at columns E-H (row {row_num}).")
 
+def read_trading_orders(user_id: str):
+    """
+    Returns the rows of the second table (columns E-I) of the user's sheet in one read-only pass, as
+    (date, buy trades, sell trades, base change, approximate profit) tuples.
+    """
+    create_excel_sheet(user_id)
+    file_name = "Excel sheets/" + user_id + ".xlsx"
+    wb = openpyxl.load_workbook(file_name, read_only=True)
+    try:
+        rows = wb[user_id].iter_rows(min_row=2, min_col=5, max_col=9, values_only=True)
+        return [tuple(row) for row in rows if any(value is not None and value != "" for value in row)]
+    finally:
+        wb.close()
+
 def get_access_token(user_id):
     """
     Reads the access token from cell J1 in the sheet in 'multiple_trading_sheet.xlsx'.
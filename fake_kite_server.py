@@ -0,0 +1,340 @@
+"""
+Local stand-in for the Kite Connect REST API, for load and latency testing without broker credentials.
+Implements the endpoints the engine uses on top of one kite_stubs.StubKite per API key, speaking the
+same JSON envelope and error types as Kite, so a KiteConnect pointed at it with root=server.url works unchanged.
+Latency, error rate and per-account rate limits (answered with 429 like Kite does) are configurable.
+It also stands in for the Kite web login (/connect/login, /api/login and /api/twofa), for http_login.
+"""
+import csv
+import hashlib
+import io
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+import pyotp
+import config
+import kite_stubs
+from rate_limiter import TokenBucket
+
+ROUTES = [
+    ("GET", r"/quote/ltp", "ltp", "quote"),
+    ("GET", r"/quote", "quote", "quote"),
+    ("GET", r"/instruments/(?P<exchange>[^/]+)", "instruments", "other"),
+    ("GET", r"/orders", "orders", "other"),
+    ("GET", r"/orders/(?P<order_id>[^/]+)", "order_history", "other"),
+    ("POST", r"/orders/(?P<variety>[^/]+)", "place_order", "order"),
+    ("PUT", r"/orders/(?P<variety>[^/]+)/(?P<order_id>[^/]+)", "modify_order", "order"),
+    ("DELETE", r"/orders/(?P<variety>[^/]+)/(?P<order_id>[^/]+)", "cancel_order", "order"),
+    ("GET", r"/portfolio/holdings", "holdings", "other"),
+    ("GET", r"/portfolio/positions", "positions", "other"),
+    ("GET", r"/user/profile", "profile", "other"),
+    ("POST", r"/session/token", "create_session", None),
+    ("DELETE", r"/session/token", "delete_session", None),
+]
+
+
+class KiteError(Exception):
+    """Error answered to the client as a Kite error response"""
+    def __init__(self, status, error_type, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+        self.message = message
+
+
+class FakeKiteServer:
+    """
+    Threaded HTTP server answering Kite REST calls.
+    - latency / jitter: seconds added to every response, jitter drawn uniformly
+    - error_rate: share of requests answered with a 503 NetworkException
+    - rate_limits: requests per second per API key and category, by default Kite's own config.kite_rate_limits; None disables them
+    - prices / step / fill_ratio: passed to the StubKite of every account
+    - api_secrets: {api_key: api_secret}; when given, session requests must carry a valid checksum
+    - valid_tokens: access tokens accepted besides the ones the server issues; None accepts any token
+    - logins: {user_id: (password, base32 TOTP secret)} accepted by the web login; None accepts any credentials
+    - redirect_url: where a completed web login is redirected to with its request_token
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limits=config.kite_rate_limits,
+                 prices=None, step=1.0, fill_ratio=1.0, seed=None, api_secrets=None, valid_tokens=None, logins=None,
+                 redirect_url="http://127.0.0.1/kite_redirect"):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limits = rate_limits
+        self.prices = prices or {}
+        self.step = step
+        self.fill_ratio = fill_ratio
+        self.random = random.Random(seed)
+        self.api_secrets = api_secrets
+        self.valid_tokens = None if valid_tokens is None else set(valid_tokens)
+        self.logins = logins
+        self.redirect_url = redirect_url
+        # Web login sessions by session cookie: {"user_id", "request_id", "authenticated"}
+        self.login_sessions = {}
+        self.request_tokens = set()
+        self.accounts = {}
+        self.buckets = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-kite-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def account(self, api_key):
+        """Returns the StubKite holding the prices, orders and holdings of an API key"""
+        with self.lock:
+            kite = self.accounts.get(api_key)
+            if kite is None:
+                kite = self.accounts[api_key] = kite_stubs.StubKite(self.prices, self.step, self.fill_ratio,
+                                                                    seed=self.random.random(), api_key=api_key)
+            return kite
+
+    def count(self, name, outcome):
+        with self.lock:
+            counts = self.stats.setdefault(name, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def allow(self, api_key, category):
+        if self.rate_limits is None or category is None:
+            return True
+        with self.lock:
+            bucket = self.buckets.get((api_key, category))
+            if bucket is None:
+                rate = self.rate_limits[category]
+                bucket = self.buckets[(api_key, category)] = TokenBucket(rate, rate)
+        return bucket.try_acquire()
+
+    def authenticate(self, authorization):
+        """Returns the API key of a "token api_key:access_token" header"""
+        match = re.fullmatch(r"token ([^:]+):(.+)", authorization or "")
+        if match is None:
+            raise KiteError(403, "TokenException", "Incorrect `api_key` or `access_token`.")
+        api_key, access_token = match.groups()
+        if self.valid_tokens is not None and access_token not in self.valid_tokens:
+            raise KiteError(403, "TokenException", "Incorrect `api_key` or `access_token`.")
+        return api_key
+
+    def handle(self, method, path, query, form, authorization):
+        """Answers one request. Returns (status, content type, body bytes)."""
+        for route_method, pattern, name, category in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            raise KiteError(404, "GeneralException", f"Route not found: {method} {path}")
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count(name, "error")
+            raise KiteError(503, "NetworkException", "Simulated upstream error")
+        if name in ("create_session", "delete_session"):
+            data = getattr(self, name)(query, form)
+            self.count(name, "ok")
+            return 200, "application/json", json.dumps({"status": "success", "data": data}).encode()
+
+        api_key = self.authenticate(authorization)
+        if not self.allow(api_key, category):
+            self.count(name, "429")
+            raise KiteError(429, "NetworkException", "Too many requests")
+        kite = self.account(api_key)
+        args = match.groupdict()
+        try:
+            if name in ("ltp", "quote"):
+                data = getattr(kite, name)(query.get("i", []))
+            elif name == "instruments":
+                self.count(name, "ok")
+                return 200, "text/csv", self.instruments_csv(kite, args["exchange"])
+            elif name == "place_order":
+                fields = {key: values[-1] for key, values in form.items() if key != "variety"}
+                fields["quantity"] = int(fields["quantity"])
+                fields["price"] = float(fields["price"]) if fields.get("price") else None
+                data = {"order_id": kite.place_order(args["variety"], **fields)}
+            elif name == "modify_order":
+                fields = {key: values[-1] for key, values in form.items()}
+                data = {"order_id": kite.modify_order(args["variety"], args["order_id"],
+                                                      quantity=int(fields["quantity"]) if "quantity" in fields else None,
+                                                      price=float(fields["price"]) if "price" in fields else None)}
+            elif name == "cancel_order":
+                data = {"order_id": kite.cancel_order(args["variety"], args["order_id"])}
+            elif name == "order_history":
+                data = kite.order_history(args["order_id"])
+            else:
+                data = getattr(kite, name)()
+        except KeyError as e:
+            self.count(name, "error")
+            raise KiteError(400, "InputException", f"Invalid or missing input: {e}")
+        except TypeError as e:
+            self.count(name, "error")
+            raise KiteError(400, "InputException", str(e))
+        self.count(name, "ok")
+        return 200, "application/json", json.dumps({"status": "success", "data": data}).encode()
+
+    def instruments_csv(self, kite, exchange):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["instrument_token", "exchange_token", "tradingsymbol", "name", "last_price", "expiry",
+                         "strike", "tick_size", "lot_size", "instrument_type", "segment", "exchange"])
+        for instrument in kite.instruments(exchange):
+            writer.writerow([instrument["instrument_token"], instrument["instrument_token"] // 256, instrument["tradingsymbol"],
+                             instrument["tradingsymbol"], 0, "", 0, 0.05, 1, "EQ", exchange, exchange])
+        return buffer.getvalue().encode()
+
+    def create_session(self, query, form):
+        """Exchanges a request token for an access token, as KiteConnect.generate_session does"""
+        fields = {key: values[-1] for key, values in form.items()}
+        api_key, request_token = fields.get("api_key"), fields.get("request_token")
+        if not api_key or not request_token:
+            raise KiteError(400, "InputException", "Missing api_key or request_token")
+        if self.api_secrets is not None:
+            secret = self.api_secrets.get(api_key, "")
+            expected = hashlib.sha256((api_key + request_token + secret).encode()).hexdigest()
+            if fields.get("checksum") != expected:
+                raise KiteError(403, "TokenException", "Invalid `checksum`.")
+        access_token = secrets.token_hex(16)
+        with self.lock:
+            if self.valid_tokens is not None:
+                self.valid_tokens.add(access_token)
+        return {"user_id": api_key, "api_key": api_key, "access_token": access_token, "public_token": secrets.token_hex(8),
+                "refresh_token": "", "login_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "user_name": "Stub"}
+
+    def delete_session(self, query, form):
+        access_token = (query.get("access_token") or [""])[-1]
+        with self.lock:
+            if self.valid_tokens is not None:
+                self.valid_tokens.discard(access_token)
+        return True
+
+    def handle_login(self, method, path, query, form, session_id):
+        """
+        Answers one request of the web login. Returns (status, content type, body bytes, headers).
+        The session cookie is set by the first request; /connect/login redirects with a request token once
+        /api/login and /api/twofa have succeeded in that session.
+        """
+        headers = {}
+        with self.lock:
+            session = self.login_sessions.get(session_id)
+            if session is None:
+                session_id = secrets.token_hex(16)
+                session = self.login_sessions[session_id] = {"user_id": None, "request_id": None, "authenticated": False}
+                headers["Set-Cookie"] = f"kf_session={session_id}; Path=/; HttpOnly"
+        fields = {key: values[-1] for key, values in form.items()}
+
+        if method == "GET" and path == "/connect/login":
+            if not (query.get("api_key") or [""])[-1]:
+                raise KiteError(400, "InputException", "Missing api_key")
+            if not session["authenticated"]:
+                self.count("connect_login", "ok")
+                return 200, "text/html", b"<html><body>Kite login</body></html>", headers
+            request_token = secrets.token_hex(16)
+            with self.lock:
+                self.request_tokens.add(request_token)
+            headers["Location"] = self.redirect_url + "?" + urlencode({"action": "login", "type": "login", "status": "success",
+                                                                       "request_token": request_token})
+            self.count("connect_login", "redirect")
+            return 302, "text/html", b"", headers
+
+        if method == "POST" and path == "/api/login":
+            user_id, password = fields.get("user_id", ""), fields.get("password", "")
+            if not user_id or not password or (self.logins is not None and self.logins.get(user_id, (None,))[0] != password):
+                self.count("api_login", "error")
+                raise KiteError(403, "InputException", "Invalid `user_id` or `password`.")
+            session.update(user_id=user_id, request_id=secrets.token_hex(16), authenticated=False)
+            self.count("api_login", "ok")
+            data = {"user_id": user_id, "request_id": session["request_id"], "twofa_type": "totp", "twofa_types": ["totp"]}
+            return 200, "application/json", json.dumps({"status": "success", "data": data}).encode(), headers
+
+        if method == "POST" and path == "/api/twofa":
+            user_id, request_id, value = fields.get("user_id"), fields.get("request_id"), fields.get("twofa_value", "")
+            if session["request_id"] is None or (user_id, request_id) != (session["user_id"], session["request_id"]):
+                self.count("api_twofa", "error")
+                raise KiteError(403, "TokenException", "Invalid or expired request.")
+            if self.logins is not None:
+                valid = pyotp.TOTP(self.logins[user_id][1]).verify(value, valid_window=1)
+            else:
+                valid = re.fullmatch(r"\d{6}", value) is not None
+            if not valid:
+                self.count("api_twofa", "error")
+                raise KiteError(403, "TwoFAException", "Invalid TOTP.")
+            session["authenticated"] = True
+            headers["Set-Cookie"] = f"enctoken={secrets.token_hex(16)}; Path=/; HttpOnly"
+            self.count("api_twofa", "ok")
+            return 200, "application/json", json.dumps({"status": "success", "data": {"profile": {}}}).encode(), headers
+
+        raise KiteError(404, "GeneralException", f"Route not found: {method} {path}")
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a requests session reuses its connection like it does with Kite
+            protocol_version = "HTTP/1.1"
+
+            def respond(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode()) if length else {}
+                start = time.monotonic()
+                headers = {}
+                try:
+                    if url.path == "/connect/login" or url.path.startswith("/api/"):
+                        cookie = SimpleCookie(self.headers.get("Cookie") or "").get("kf_session")
+                        status, content_type, body, headers = server.handle_login(self.command, url.path, parse_qs(url.query), form,
+                                                                                  cookie.value if cookie else None)
+                    else:
+                        status, content_type, body = server.handle(self.command, url.path, parse_qs(url.query), form,
+                                                                   self.headers.get("Authorization"))
+                except KiteError as e:
+                    status, content_type = e.status, "application/json"
+                    body = json.dumps({"status": "error", "error_type": e.error_type, "message": e.message, "data": None}).encode()
+                delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+                time.sleep(max(0, delay - (time.monotonic() - start)))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    with FakeKiteServer(port=8765) as server:
+        print(f"Fake Kite server listening on {server.url}. Point KiteConnect(api_key, root=\"{server.url}\") at it.")
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,225 @@
+"""
+Grid state of one account, shared by the polling, tick-driven and asyncio engines.
+GridBook holds the base prices, number of trades, open orders and counters of an account and applies
+the grid rules and their state changes to them. It makes no Kite calls: the engines fetch prices,
+place, cancel and look up orders, and pass the results in.
+"""
+import time
+from datetime import datetime
+import grid_strategy
+
+# Statuses after which the filled quantity of an order can no longer change
+TERMINAL_STATUSES = ("COMPLETE", "CANCELLED", "REJECTED")
+
+
+class GridBook:
+    """
+    Class holding the grid state of one account.
+    open_order maps a symbol to the id of its order placed since the last reconciliation, placed_at
+    to the time.monotonic() it was placed at and placed_side to its side, "BUY" or "SELL"; an order
+    leaves all three only once it has been recorded as completed or rolled back.
+    """
+    def __init__(self, user_id: str, state, symbols: dict, percent: int):
+        self.user_id = user_id
+        # state is the user's state_store.open_user_state object
+        self.state = state
+        self.symbols = symbols
+        self.percent = percent
+        self.base_price = {}
+        self.number_of_trades = {}
+        self.open_order = {}
+        self.placed_at = {}
+        self.placed_side = {}
+        self.trade_counts = {"buy_trades": 0, "sell_trades": 0, "base_change": 0}
+        self.trading_symbols = []
+
+    def log(self, message):
+        time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{self.user_id}: {time_now}: {message}")
+
+    def select_symbols(self):
+        """
+        Sets trading_symbols to the symbols of the user's state that are in the config.
+        Returns the ones without a stored price, which need a starting price from load_symbols.
+        """
+        self.trading_symbols = []
+        for symbol in self.state.symbols():
+            if symbol not in self.symbols:
+                print(f"{self.user_id}: Symbol {symbol} not found in the config. Skipping...")
+                continue
+            self.trading_symbols.append(symbol)
+        return [symbol for symbol in self.trading_symbols if self.state.get_last_price(symbol) is None]
+
+    def load_symbols(self, missing_symbols, starting_prices: dict):
+        """Loads base price and number of trades of every trading symbol, starting the missing ones at starting_prices"""
+        for symbol in self.trading_symbols:
+            if symbol in missing_symbols:
+                self.base_price[symbol] = starting_prices.get(symbol)
+                self.number_of_trades[symbol] = 0
+            else:
+                self.base_price[symbol] = self.state.get_last_price(symbol)
+                self.number_of_trades[symbol] = self.state.get_lots(symbol)
+
+    def decide(self, symbol: str, current_price, nifty_day_change):
+        """
+        Returns the grid action for symbol at current_price, or None while the symbol still has an open order.
+        nifty_day_change is the callable grid_strategy.decide_action expects.
+        """
+        if symbol in self.open_order:
+            return None
+        return grid_strategy.decide_action(current_price, self.base_price[symbol], self.number_of_trades[symbol],
+                                           self.trade_counts["buy_trades"], self.percent, nifty_day_change)
+
+    def order_side(self, action):
+        """Returns the side of the order placed for action, or None if it places no order"""
+        if action in (grid_strategy.FIRST_BUY, grid_strategy.BUY):
+            return "BUY"
+        if action == grid_strategy.SELL:
+            return "SELL"
+        return None
+
+    def log_action(self, symbol: str, action, current_price):
+        """Logs the order about to be placed for action"""
+        if action == grid_strategy.FIRST_BUY:
+            self.log(f"Placing first buy order for {symbol} at {current_price}")
+        elif action == grid_strategy.BUY:
+            self.log(f"Target buy price {current_price} for {symbol} reached. Placing buy order... Current number of trades = {self.number_of_trades[symbol]+1}")
+        elif action == grid_strategy.SELL:
+            self.log(f"Target sell price {current_price} for {symbol} reached. Placing sell order... Current number of trades = {self.number_of_trades[symbol]-1}")
+
+    def apply_action(self, symbol: str, action, order_id=None):
+        """
+        Updates the symbol's state for action. order_id is the id of the order placed for it, or None
+        if the order was refused, which leaves the state unchanged; a base change places no order.
+        """
+        if action == grid_strategy.BASE_CHANGE:
+            self.trade_counts["base_change"] += 1
+            self.base_price[symbol] = grid_strategy.sell_price(self.base_price[symbol], self.percent)
+            self.state.upsert(symbol, self.number_of_trades[symbol], self.base_price[symbol])
+            self.log(f"Changing base price for {symbol} to {self.base_price[symbol]}")
+            return
+        if order_id is None:
+            return
+        if action == grid_strategy.BUY:
+            self.base_price[symbol] = grid_strategy.buy_price(self.base_price[symbol], self.percent)
+            self.number_of_trades[symbol] += 1
+        elif action == grid_strategy.SELL:
+            self.base_price[symbol] = grid_strategy.sell_price(self.base_price[symbol], self.percent)
+            self.number_of_trades[symbol] -= 1
+        else:
+            self.number_of_trades[symbol] += 1
+        self.state.upsert(symbol, self.number_of_trades[symbol], self.base_price[symbol])
+        self.open_order[symbol] = order_id
+        self.placed_at[symbol] = time.monotonic()
+        self.placed_side[symbol] = self.order_side(action)
+
+    def adopt_open_orders(self, orders):
+        """
+        Takes over the orders of orders (a kite.orders() list) still open for a trading symbol, e.g. the ones
+        of a worker that died, so the next reconciliation records or cancels and rolls them back like its own.
+        Their state change is taken to be stored already. Returns the number of orders taken over.
+        """
+        adopted = 0
+        for order in orders:
+            symbol = order.get("tradingsymbol")
+            if order.get("status") in TERMINAL_STATUSES or symbol not in self.trading_symbols or symbol in self.open_order:
+                continue
+            self.open_order[symbol] = order["order_id"]
+            # Placed before this run started, so due at the first reconciliation
+            self.placed_at[symbol] = 0
+            self.placed_side[symbol] = order["transaction_type"]
+            adopted += 1
+            self.log(f"Taking over open {order['transaction_type'].lower()} order {order['order_id']} for {symbol}")
+        return adopted
+
+    def symbol_of(self, order_id):
+        """Returns the symbol whose open order is order_id, or None if it is no longer open"""
+        for symbol, open_order_id in self.open_order.items():
+            if open_order_id == order_id:
+                return symbol
+        return None
+
+    def due_orders(self, min_age=0):
+        """Returns {symbol: order_id} of the open orders placed at least min_age seconds ago"""
+        now = time.monotonic()
+        return {symbol: order_id for symbol, order_id in self.open_order.items() if now - self.placed_at.get(symbol, 0) >= min_age}
+
+    def record_completed_order(self, symbol: str, order: dict):
+        """Function to count a completed order and store the symbol's state after a sell"""
+        self.log(f"Order for {symbol} completed. Deleting order id {order['order_id']}")
+        if order["transaction_type"] == "SELL":
+            self.state.upsert(symbol, self.number_of_trades[symbol], self.base_price[symbol])
+            self.trade_counts["sell_trades"] += 1
+        else:
+            self.trade_counts["buy_trades"] += 1
+        self.open_order.pop(symbol, None)
+        self.placed_at.pop(symbol, None)
+        self.placed_side.pop(symbol, None)
+
+    def record_completed_orders(self, orders: dict, order_book: dict):
+        """
+        Records the orders of orders ({symbol: order_id}) that order_book ({order_id: order}) shows completed.
+        Returns the others.
+        """
+        unfinished = {}
+        for symbol, order_id in orders.items():
+            order = order_book.get(order_id)
+            if order is not None and order["status"] == "COMPLETE":
+                self.record_completed_order(symbol, order)
+            else:
+                unfinished[symbol] = order_id
+        return unfinished
+
+    def cancel_pending(self, orders: dict, order_book: dict):
+        """Returns whether order_book still shows an order of orders ({symbol: order_id}) without a final status"""
+        return any(order_id in order_book and order_book[order_id]["status"] not in TERMINAL_STATUSES for order_id in orders.values())
+
+    def settle_cancelled_orders(self, orders: dict, order_book: dict):
+        """
+        Settles the orders of orders ({symbol: order_id}) after they were cancelled: records the ones that filled
+        before the cancellation reached the exchange and returns {symbol: order} of the ones to roll back.
+        An order whose status is not final yet stays open, as its filled quantity can still change.
+        """
+        cancelled = {}
+        for symbol, order_id in self.record_completed_orders(orders, order_book).items():
+            order = order_book.get(order_id, {})
+            if order and order["status"] not in TERMINAL_STATUSES:
+                self.log(f"Order {order_id} for {symbol} still {order['status']} after cancelling. Checking it again next reconciliation")
+                continue
+            cancelled[symbol] = order
+        return cancelled
+
+    def side_of(self, symbol: str, order: dict):
+        """Returns the side of the symbol's open order, as placed, falling back to order for one placed elsewhere"""
+        return self.placed_side.get(symbol, order.get("transaction_type"))
+
+    def square_off(self, symbol: str, order: dict):
+        """Returns (side, quantity) of the order squaring off the partially filled quantity of order, or None"""
+        filled_quantity = order.get("filled_quantity", 0)
+        if 0 < filled_quantity < self.symbols[symbol]:
+            return ("SELL" if self.side_of(symbol, order) == "BUY" else "BUY"), filled_quantity
+        return None
+
+    def roll_back_needs_price(self, symbol: str, order: dict):
+        """Returns whether rolling back order restarts the symbol at its current price, as its last lot was a cancelled buy"""
+        return self.side_of(symbol, order) == "BUY" and self.number_of_trades[symbol] == 1
+
+    def roll_back(self, symbol: str, order: dict, current_price=None):
+        """
+        Rolls back the state change of a cancelled or rejected order; order is {} if the order book
+        no longer shows it. current_price is only used, and only needs fetching, when roll_back_needs_price says so.
+        """
+        if self.side_of(symbol, order) == "BUY":
+            self.number_of_trades[symbol] -= 1
+            if self.number_of_trades[symbol] == 0:
+                self.base_price[symbol] = current_price
+            else:
+                self.base_price[symbol] = grid_strategy.sell_price(self.base_price[symbol], self.percent)
+        else:
+            self.number_of_trades[symbol] += 1
+            self.base_price[symbol] = grid_strategy.buy_price(self.base_price[symbol], self.percent)
+        self.state.upsert(symbol, self.number_of_trades[symbol], self.base_price[symbol])
+        self.open_order.pop(symbol, None)
+        self.placed_at.pop(symbol, None)
+        self.placed_side.pop(symbol, None)
+        self.log(f"Order for {symbol} cancelled. Changing base price to {self.base_price[symbol]}")
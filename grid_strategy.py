@@ -0,0 +1,69 @@
+"""
+Decision rules of the grid strategy used by multiple_trading.
+Kept free of any Kite or Excel calls so the polling loop and the tick-driven engine
+evaluate a symbol in exactly the same way. decide_actions applies the same rules to
+arrays of symbols at once for the backtester.
+"""
+import numpy as np
+
+FIRST_BUY = "FIRST_BUY"
+BUY = "BUY"
+SELL = "SELL"
+BASE_CHANGE = "BASE_CHANGE"
+# decide_actions returns indexes into ACTIONS
+ACTIONS = (None, FIRST_BUY, BUY, SELL, BASE_CHANGE)
+NO_ACTION, FIRST_BUY_CODE, BUY_CODE, SELL_CODE, BASE_CHANGE_CODE = range(len(ACTIONS))
+
+MAX_LOTS = 5
+DAILY_BUY_CAP = 50
+NIFTY_FLOOR = -4
+
+
+def buy_price(base_price, percent):
+    """Returns the price at which the next lot is bought"""
+    return base_price*(100-percent)/100
+
+
+def sell_price(base_price, percent):
+    """Returns the price at which a lot is sold or the base price is moved up"""
+    return base_price*100/(100-percent)
+
+
+def decide_action(current_price, base_price, lots, buy_trades, percent, nifty_day_change,
+                  max_lots=MAX_LOTS, daily_buy_cap=DAILY_BUY_CAP, nifty_floor=NIFTY_FLOOR):
+    """
+    Returns the action the grid rules take for one symbol at current_price, or None.
+    nifty_day_change is a callable returning the NIFTY 50 day change in percent; it is
+    only called once the symbol has reached its buy price.
+    max_lots, daily_buy_cap and nifty_floor default to the limits the live engine trades with.
+    """
+    # Place the first buy order if no trades have been made yet
+    if lots == 0:
+        return FIRST_BUY
+    # If current price is less than the base price by percent and lots are less than max_lots, buy
+    if current_price <= buy_price(base_price, percent) and lots < max_lots and buy_trades < daily_buy_cap and nifty_day_change() > nifty_floor:
+        return BUY
+    # If current price is greater than the base price by percent and more than one lot is held, sell
+    if current_price >= sell_price(base_price, percent) and lots > 1:
+        return SELL
+    # If current price is greater than the base price by percent and one lot is held, move the base price up
+    if current_price >= sell_price(base_price, percent):
+        return BASE_CHANGE
+    return None
+
+
+def decide_actions(current_prices, base_prices, lots, buy_trades, percent, nifty_day_change,
+                   max_lots=MAX_LOTS, daily_buy_cap=DAILY_BUY_CAP, nifty_floor=NIFTY_FLOOR):
+    """
+    Array version of decide_action for many symbols at one point in time.
+    current_prices, base_prices and lots are arrays with one entry per symbol; buy_trades and
+    nifty_day_change are the day's buy count and NIFTY 50 day change in percent at that time.
+    Returns an array of codes indexing ACTIONS; symbols with a NaN price get NO_ACTION.
+    """
+    # Rules are applied from the lowest to the highest priority in decide_action, so the first match there wins here
+    above_sell_price = current_prices >= sell_price(base_prices, percent)
+    codes = np.where(above_sell_price, np.where(lots > 1, SELL_CODE, BASE_CHANGE_CODE), NO_ACTION)
+    if buy_trades < daily_buy_cap and nifty_day_change > nifty_floor:
+        codes = np.where((current_prices <= buy_price(base_prices, percent)) & (lots < max_lots), BUY_CODE, codes)
+    codes = np.where(lots == 0, FIRST_BUY_CODE, codes)
+    return np.where(np.isnan(current_prices), NO_ACTION, codes)
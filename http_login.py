@@ -0,0 +1,99 @@
+"""
+Kite login over plain HTTP, without a browser.
+Performs the requests the Kite login page makes: opening the Connect login URL, posting the user id and
+password to /api/login, posting the TOTP to /api/twofa, and opening the login URL again, which now
+redirects to the app's redirect URL carrying the request_token. Cookies are kept in one requests.Session.
+"""
+import sys
+import time
+from urllib.parse import urljoin, urlparse, parse_qs
+import requests
+import config
+import generate_access_token
+import otp_test
+
+MAX_REDIRECTS = 10
+
+
+class LoginError(Exception):
+    """The login was refused or the request token could not be found"""
+
+
+def request_token_from(url):
+    return parse_qs(urlparse(url).query).get("request_token", [None])[0]
+
+
+def follow_redirects(session, url, timeout):
+    """
+    Opens url and follows its redirects without loading the last one, which is the app's redirect URL.
+    Returns the request token of the first URL carrying one, else None.
+    """
+    for _ in range(MAX_REDIRECTS):
+        request_token = request_token_from(url)
+        if request_token:
+            return request_token
+        response = session.get(url, allow_redirects=False, timeout=timeout)
+        if not response.is_redirect:
+            return None
+        location = response.headers.get("Location")
+        if not location:
+            raise LoginError(f"Redirect without a Location from {url}")
+        url = urljoin(url, location)
+    return request_token_from(url)
+
+
+def post_json(session, url, data, timeout):
+    """Posts a form to a Kite login endpoint and returns the "data" of its answer, raising LoginError on an error answer"""
+    response = session.post(url, data=data, timeout=timeout)
+    try:
+        body = response.json()
+    except ValueError:
+        raise LoginError(f"Unexpected answer from {url}: HTTP {response.status_code}")
+    if body.get("status") != "success":
+        raise LoginError(body.get("message") or f"HTTP {response.status_code} from {url}")
+    return body.get("data") or {}
+
+
+def get_request_token(user_id: str, login_url=None, root=None, timeout=10):
+    """
+    Logs the user in and returns the request token. login_url is the Connect login URL, by default the one
+    of the user's API key; root is the host of the login API, by default the host of login_url.
+    Raises LoginError if Kite refuses the login and requests.RequestException on network errors.
+    """
+    login_url = login_url or generate_access_token.print_url(user_id)
+    parsed = urlparse(login_url)
+    root = root or f"{parsed.scheme}://{parsed.netloc}"
+    keys = config.config_keys[user_id]
+    with requests.Session() as session:
+        session.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+        session.headers["X-Kite-Version"] = "3"
+        # Sets the session cookies the login API expects
+        request_token = follow_redirects(session, login_url, timeout)
+        if request_token:
+            return request_token
+
+        data = post_json(session, root + "/api/login", {"user_id": user_id, "password": keys["password"]}, timeout)
+        request_id = data.get("request_id")
+        if not request_id:
+            raise LoginError("No request_id in the /api/login answer")
+        totp = otp_test.run_parser(keys["qr_link"])
+        post_json(session, root + "/api/twofa", {"user_id": user_id, "request_id": request_id, "twofa_value": totp,
+                                                 "twofa_type": "totp", "skip_totp": "true"}, timeout)
+
+        separator = "&" if parsed.query else "?"
+        request_token = follow_redirects(session, login_url + separator + "skip_session=true", timeout)
+    if not request_token:
+        raise LoginError("Login did not redirect with a request_token")
+    return request_token
+
+
+def generate_http_access_token(user_id: str, login_url=None, root=None, timeout=10):
+    """Logs the user in over HTTP and exchanges the request token. Returns the access token, also stored in the user's state."""
+    start = time.monotonic()
+    request_token = get_request_token(user_id, login_url, root, timeout)
+    print(f"{user_id}: HTTP login took {time.monotonic() - start:.2f} s")
+    return generate_access_token.generate_access_token(user_id, request_token)
+
+
+if __name__ == '__main__':
+    generate_http_access_token(sys.argv[1] if len(sys.argv) > 1 else config.ID[0])
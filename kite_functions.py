@@ -1,10 +1,17 @@
 import time
+import threading
 from kiteconnect import KiteConnect
 import config
 import openpyxl
 from datetime import datetime
 import database
 import excel_functions
+import kite_metrics
+import reports
+from rate_limiter import throttle
+
+# Maximum number of instruments Kite accepts in a single ltp request
+LTP_INSTRUMENT_LIMIT = 1000
 
 
 class Order:
@@ -20,8 +27,74 @@ class Order:
 order = Order("RELIANCE", "BSE", 1, 0, "BUY")
 
 
+class TTLCache:
+    """
+    Read-through cache for Kite responses with a time-to-live per endpoint (config.cache_ttl).
+    Entries are kept per account, and concurrent readers of a stale entry share a single fetch.
+    """
+    def __init__(self, ttl: dict):
+        self.ttl = ttl
+        self.entries = {}   # (account, endpoint) -> (expiry time, value)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, kite, endpoint: str, fetch):
+        key = (getattr(kite, "api_key", id(kite)), endpoint)
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            value = fetch()
+            self.entries[key] = (time.monotonic() + self.ttl.get(endpoint, 0), value)
+            return value
+
+    def invalidate(self, kite, *endpoints):
+        account = getattr(kite, "api_key", id(kite))
+        with self.lock:
+            for endpoint in endpoints:
+                self.entries.pop((account, endpoint), None)
+
+
+cache = TTLCache(config.cache_ttl)
+
+
+class OrderUpdateStream:
+    """
+    Class to dispatch order updates pushed by the broker to engine callbacks.
+    attach() hooks it to the on_order_update messages of a KiteTicker (or kite_stubs.ReplayTicker).
+    Each callback receives the order update dict; partial fills are updates of a still
+    open order whose filled_quantity is between 0 and quantity.
+    """
+    def __init__(self, on_complete=None, on_cancelled=None, on_rejected=None, on_partial_fill=None):
+        self.on_complete = on_complete
+        self.on_cancelled = on_cancelled
+        self.on_rejected = on_rejected
+        self.on_partial_fill = on_partial_fill
+
+    def attach(self, ticker):
+        ticker.on_order_update = self.dispatch
+
+    def dispatch(self, ws, data):
+        status = data.get("status")
+        if status == "COMPLETE":
+            callback = self.on_complete
+        elif status == "CANCELLED":
+            callback = self.on_cancelled
+        elif status == "REJECTED":
+            callback = self.on_rejected
+        elif 0 < data.get("filled_quantity", 0) < data.get("quantity", 0):
+            callback = self.on_partial_fill
+        else:
+            callback = None
+        if callback is not None:
+            callback(data)
+
+
 def get_order_side(kite, order_id):
     """Function to get the side of an order"""
+    throttle(kite, "other")
     orders = kite.orders()
     for order in orders:
         if order["order_id"] == order_id:
@@ -29,6 +102,15 @@ def get_order_side(kite, order_id):
     return None
 
 
+def get_order_book(kite):
+    """
+    Returns a snapshot of the day's orders indexed by order_id, fetched with a single kite.orders() call.
+    Each entry holds the latest status, transaction_type and filled_quantity of the order.
+    """
+    throttle(kite, "other")
+    return {order["order_id"]: order for order in kite.orders()}
+
+
 def place_order(kite, order):
     """Function to place a buy order"""
     transaction_type = kite.TRANSACTION_TYPE_BUY
@@ -38,6 +120,7 @@ def place_order(kite, order):
         transaction_type = kite.TRANSACTION_TYPE_SELL
         
     try:
+        throttle(kite, "order")
         order_id = kite.place_order(
             variety=kite.VARIETY_REGULAR,
             tradingsymbol=order.tradingsymbol,
@@ -50,6 +133,7 @@ def place_order(kite, order):
             validity=kite.VALIDITY_DAY,        # Order validity
         )
         print(f"{transaction_type} order placed successfully. Order ID: {order_id}")
+        cache.invalidate(kite, "holdings", "positions")
         return order_id
     
     except Exception as e:
@@ -58,6 +142,7 @@ def place_order(kite, order):
 
 def check_if_order_status_complete(kite, order_id):
     """Function to check the status of an order"""
+    throttle(kite, "other")
     order_history = kite.order_history(order_id=order_id)
     if order_history:
         latest_status = order_history[-1]["status"]
@@ -71,20 +156,64 @@ def get_current_price(kite, symbol: str, exchange: str, retries=3, delay=5):
     """Function to get the current price of the stock with retry mechanism"""
     for attempt in range(retries):
         try:
+            throttle(kite, "quote")
             quote = kite.ltp(f"{exchange}:{symbol}")
             return quote[f"{exchange}:{symbol}"]["last_price"]
         except Exception as e:
             print(f"Error fetching price for {symbol}: {str(e)}. Retrying in {delay} seconds...")
+            # Only attempts followed by another one are retries
+            if attempt < retries - 1:
+                kite_metrics.record_retry(kite, "ltp")
             time.sleep(delay)
     return None
 
 
+def get_current_prices(kite, symbols, exchange: str, retries=3, delay=5):
+    """
+    Returns a {symbol: last_price} snapshot for all the given symbols.
+    The symbols are fetched with as few kite.ltp calls as possible, split at LTP_INSTRUMENT_LIMIT.
+    Symbols whose price could not be fetched are left out of the snapshot.
+    """
+    symbols = list(symbols)
+    prices = {}
+    for start in range(0, len(symbols), LTP_INSTRUMENT_LIMIT):
+        instruments = [f"{exchange}:{symbol}" for symbol in symbols[start:start + LTP_INSTRUMENT_LIMIT]]
+        quotes = None
+        for attempt in range(retries):
+            try:
+                throttle(kite, "quote")
+                quotes = kite.ltp(instruments)
+                break
+            except Exception as e:
+                print(f"Error fetching prices for {len(instruments)} symbols: {str(e)}. Retrying in {delay} seconds...")
+                if attempt < retries - 1:
+                    kite_metrics.record_retry(kite, "ltp")
+                time.sleep(delay)
+        if quotes is None:
+            continue
+        for instrument, quote in quotes.items():
+            prices[instrument.split(":", 1)[1]] = quote["last_price"]
+    return prices
+
+
+def get_instrument_tokens(kite, symbols, exchange: str):
+    """
+    Returns a {symbol: instrument_token} mapping for the given symbols, as needed to subscribe them on the ticker.
+    """
+    symbols = set(symbols)
+    throttle(kite, "other")
+    return {instrument["tradingsymbol"]: instrument["instrument_token"]
+            for instrument in kite.instruments(exchange) if instrument["tradingsymbol"] in symbols}
+
+
 def delete_open_orders(kite):
     """Function to delete all open orders"""
     try:
+        throttle(kite, "other")
         orders = kite.orders()
         for order in orders:
             if order["status"] == "OPEN":
+                throttle(kite, "order")
                 kite.cancel_order(order_id=order["order_id"])
                 print(f"Order {order['order_id']} cancelled")
     except Exception as e:
@@ -94,7 +223,9 @@ def delete_open_orders(kite):
 def cancel_order(kite, order_id):
     """Function to delete a specific open order given the order id"""
     try:
+        throttle(kite, "order")
         kite.cancel_order(order_id=order_id, variety=kite.VARIETY_REGULAR)
+        cache.invalidate(kite, "holdings", "positions")
         print(f"Order {order_id} cancelled")
     except Exception as e:
         print(f"Failed to delete order {order_id}: {str(e)}")
@@ -114,7 +245,7 @@ def start_trading_for_one_symbol(kite, symbol: str, exchange: str, percent: int)
         current_time = datetime.now().time()
         if current_time.hour >= 15 and current_time.minute > 30:
             print("Market closed. Exiting...")
-            database.feed_database_in_excel()
+            reports.export_report()
             break
         current_price = get_current_price(symbol, exchange)
         if current_price is not None:
@@ -157,49 +288,70 @@ def get_filled_quantity(kite, order_id):
     Returns the filled quantity for a given order_id using Kite Connect.
     """
     # kite = get_kite_client()  # Make sure this returns an authenticated KiteConnect instance
+    throttle(kite, "other")
     orders = kite.orders()
     for order in orders:
         if order['order_id'] == order_id:
             return order['filled_quantity']
     return 0
 
+def get_holdings(kite):
+    """
+    Returns the holdings indexed by tradingsymbol, served from the cache for config.cache_ttl["holdings"] seconds.
+    """
+    def fetch():
+        throttle(kite, "other")
+        return {holding['tradingsymbol']: holding for holding in kite.holdings()}
+    return cache.get(kite, "holdings", fetch)
+
+
+def get_positions(kite):
+    """
+    Returns the day and net positions, each indexed by tradingsymbol, served from the cache
+    for config.cache_ttl["positions"] seconds.
+    """
+    def fetch():
+        throttle(kite, "other")
+        positions = kite.positions()
+        return {
+            'day': {position['tradingsymbol']: position for position in positions['day']},
+            'net': {position['tradingsymbol']: position for position in positions['net']},
+        }
+    return cache.get(kite, "positions", fetch)
+
+
 def get_ticker_quantity(kite, ticker):
     """
     Returns the quantity of shares for a given ticker in holdings.
     """
-    holdings = kite.holdings()
-    for holding in holdings:
-        if holding['tradingsymbol'] == ticker:
-            return holding['quantity']
-    return 0
-  
+    holding = get_holdings(kite).get(ticker)
+    return holding['quantity'] if holding else 0
+
 def get_ticker_positions(kite, ticker):
     """
     Returns the positions for a given ticker.
     """
-    positions = kite.positions()
-    for position in positions['day']:
-        if position['tradingsymbol'] == ticker:
-            return position['quantity']
-    return 0
+    position = get_positions(kite)['day'].get(ticker)
+    return position['quantity'] if position else 0
 
 def get_t1_positions(kite, ticker):
     """
     Returns the T1 positions for a given ticker.
     """
-    positions = kite.positions()
-    for position in positions['net']:
-        if position['tradingsymbol'] == ticker:
-            return position.get('t1_quantity', 0)
-    return 0
+    position = get_positions(kite)['net'].get(ticker)
+    return position.get('t1_quantity', 0) if position else 0
 
 def get_nifty_day_change(kite):
     """
     Returns the day change (points and percent) for NIFTY 50.
+    The quote is served from the cache for config.cache_ttl["quote"] seconds.
     """
     symbol = "NIFTY 50"
     exchange = "NSE"
-    quote = kite.quote(f"{exchange}:{symbol}")
+    def fetch():
+        throttle(kite, "quote")
+        return kite.quote(f"{exchange}:{symbol}")
+    quote = cache.get(kite, "quote", fetch)
     last_price = quote[f"{exchange}:{symbol}"]["last_price"]
     prev_close = quote[f"{exchange}:{symbol}"]["ohlc"]["close"]  # Use ohlc['close'] for previous close
     change = last_price - prev_close
@@ -0,0 +1,238 @@
+"""
+Instrumentation of Kite API calls.
+instrument(kite) wraps a KiteConnect (or AsyncKite) client so every API call records its count,
+errors and latency per account and endpoint in the shared registry `metrics`; kite_functions
+adds the retries of its retry loops and rate_limiter the time spent waiting for a token.
+The registry can be queried in process with metrics.snapshot() and is dumped in Prometheus
+text format to config.metrics_file every config.metrics_interval seconds once start_dump() is called,
+and once more by write_dump() when the engines close.
+"""
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+import config
+
+ENDPOINTS = {"ltp", "quote", "ohlc", "instruments", "orders", "order_history", "order_trades", "place_order",
+             "modify_order", "cancel_order", "holdings", "positions", "profile", "margins", "generate_session"}
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Latest latencies kept per endpoint for the percentiles of snapshot()
+RECENT_SAMPLES = 1024
+
+
+def account_name(kite):
+    """Returns the user id configured for the client's API key, or the API key itself"""
+    api_key = getattr(kite, "api_key", None)
+    for user_id, keys in config.config_keys.items():
+        if keys.get("api_key") == api_key:
+            return user_id
+    return api_key or str(id(kite))
+
+
+class EndpointStats:
+    """Counters and latencies of one endpoint of one account"""
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.retries = 0
+        self.throttle_seconds = 0.0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+class Metrics:
+    """Registry of EndpointStats keyed by (account, endpoint), safe to update from any thread"""
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        # One write at a time, as the account threads and the dump thread all write the same file at close
+        self.write_lock = threading.Lock()
+
+    def _stats(self, account, endpoint):
+        stats = self.stats.get((account, endpoint))
+        if stats is None:
+            stats = self.stats[(account, endpoint)] = EndpointStats()
+        return stats
+
+    def record_call(self, account, endpoint, seconds, error=None):
+        with self.lock:
+            stats = self._stats(account, endpoint)
+            stats.count += 1
+            stats.latency_sum += seconds
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.recent.append(seconds)
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def record_retry(self, account, endpoint):
+        with self.lock:
+            self._stats(account, endpoint).retries += 1
+
+    def record_throttle(self, account, category, seconds):
+        with self.lock:
+            self._stats(account, "throttle:" + category).throttle_seconds += seconds
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def snapshot(self, account=None, endpoint=None):
+        """
+        Returns {(account, endpoint): {...}} with count, errors, retries, throttle_seconds, mean and
+        p50/p95/p99 latency in seconds over the latest calls, filtered by account and/or endpoint.
+        """
+        with self.lock:
+            items = [(key, stats.count, dict(stats.errors), stats.retries, stats.throttle_seconds, stats.latency_sum, sorted(stats.recent))
+                     for key, stats in self.stats.items()
+                     if (account is None or key[0] == account) and (endpoint is None or key[1] == endpoint)]
+        result = {}
+        for key, count, errors, retries, throttle_seconds, latency_sum, recent in items:
+            def percentile(percent):
+                return recent[min(len(recent) - 1, int(len(recent) * percent / 100))] if recent else None
+            result[key] = {"count": count, "errors": sum(errors.values()), "errors_by_type": errors, "retries": retries,
+                           "throttle_seconds": throttle_seconds, "mean": latency_sum / count if count else None,
+                           "p50": percentile(50), "p95": percentile(95), "p99": percentile(99)}
+        return result
+
+    def prometheus_text(self):
+        """Returns the registry in the Prometheus text exposition format"""
+        with self.lock:
+            items = sorted((key, stats.count, dict(stats.errors), stats.retries, stats.throttle_seconds, stats.latency_sum, list(stats.buckets))
+                           for key, stats in self.stats.items())
+        lines = ["# HELP kite_requests_total Kite API calls made.", "# TYPE kite_requests_total counter"]
+        lines += [f'kite_requests_total{{account="{account}",endpoint="{endpoint}"}} {count}'
+                  for (account, endpoint), count, *_ in items if not endpoint.startswith("throttle:")]
+        lines += ["# HELP kite_errors_total Kite API calls that raised, by exception type.", "# TYPE kite_errors_total counter"]
+        lines += [f'kite_errors_total{{account="{account}",endpoint="{endpoint}",type="{error}"}} {errors[error]}'
+                  for (account, endpoint), _, errors, *_ in items for error in sorted(errors)]
+        lines += ["# HELP kite_retries_total Kite API calls retried by kite_functions.", "# TYPE kite_retries_total counter"]
+        lines += [f'kite_retries_total{{account="{account}",endpoint="{endpoint}"}} {retries}'
+                  for (account, endpoint), _, _, retries, *_ in items if retries]
+        lines += ["# HELP kite_throttle_seconds_total Seconds spent waiting for the rate limiter.", "# TYPE kite_throttle_seconds_total counter"]
+        lines += [f'kite_throttle_seconds_total{{account="{account}",category="{endpoint.split(":", 1)[1]}"}} {throttle_seconds:.6f}'
+                  for (account, endpoint), _, _, _, throttle_seconds, *_ in items if endpoint.startswith("throttle:")]
+        lines += ["# HELP kite_request_duration_seconds Latency of Kite API calls.", "# TYPE kite_request_duration_seconds histogram"]
+        for (account, endpoint), count, _, _, _, latency_sum, buckets in items:
+            if endpoint.startswith("throttle:"):
+                continue
+            labels = f'account="{account}",endpoint="{endpoint}"'
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'kite_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'kite_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'kite_request_duration_seconds_sum{{{labels}}} {latency_sum:.6f}')
+            lines.append(f'kite_request_duration_seconds_count{{{labels}}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_name):
+        """Writes prometheus_text() to file_name, replacing the previous dump in one step"""
+        temp_name = f"{file_name}.{os.getpid()}.tmp"
+        with self.write_lock:
+            with open(temp_name, "w") as file:
+                file.write(self.prometheus_text())
+            os.replace(temp_name, file_name)
+
+
+metrics = Metrics()
+
+
+class InstrumentedKite:
+    """
+    Proxy around a Kite client recording every API call in metrics.
+    Attributes and non-API methods are passed through, so it can be used wherever the client is.
+    """
+    def __init__(self, kite, registry=metrics):
+        self.__dict__["kite"] = kite
+        self.__dict__["registry"] = registry
+        self.__dict__["account"] = account_name(kite)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.kite, name)
+        if name not in ENDPOINTS or not callable(attribute):
+            return attribute
+        registry, account = self.registry, self.account
+
+        if inspect.iscoroutinefunction(attribute):
+            @functools.wraps(attribute)
+            async def timed_call(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await attribute(*args, **kwargs)
+                except Exception as e:
+                    registry.record_call(account, name, time.perf_counter() - start, type(e).__name__)
+                    raise
+                registry.record_call(account, name, time.perf_counter() - start)
+                return result
+        else:
+            @functools.wraps(attribute)
+            def timed_call(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = attribute(*args, **kwargs)
+                except Exception as e:
+                    registry.record_call(account, name, time.perf_counter() - start, type(e).__name__)
+                    raise
+                registry.record_call(account, name, time.perf_counter() - start)
+                return result
+        # Cached on the proxy, so later calls skip __getattr__
+        self.__dict__[name] = timed_call
+        return timed_call
+
+    def __setattr__(self, name, value):
+        setattr(self.kite, name, value)
+
+
+def instrument(kite):
+    """Returns kite wrapped in an InstrumentedKite when config.kite_metrics is set, else kite itself"""
+    return InstrumentedKite(kite) if config.kite_metrics else kite
+
+
+def record_retry(kite, endpoint: str):
+    metrics.record_retry(account_name(kite), endpoint)
+
+
+def record_throttle(kite, category: str, seconds: float):
+    if seconds > 0:
+        metrics.record_throttle(account_name(kite), category, seconds)
+
+
+dump_thread = None
+dump_file = None
+dump_lock = threading.Lock()
+
+
+def start_dump(file_name=None, interval=None):
+    """Starts the background thread writing metrics to file_name every interval seconds. Later calls do nothing."""
+    global dump_thread, dump_file
+    file_name = file_name or config.metrics_file
+    interval = interval or config.metrics_interval
+    with dump_lock:
+        if dump_thread is not None or not config.kite_metrics:
+            return
+        dump_file = file_name
+
+        def dump():
+            while True:
+                time.sleep(interval)
+                write_dump()
+        dump_thread = threading.Thread(target=dump, name="kite-metrics-dump", daemon=True)
+        dump_thread.start()
+
+
+def write_dump():
+    """
+    Writes the metrics to the file of start_dump now, so the calls since the last periodic dump are not lost
+    at shutdown. Does nothing if start_dump was not called.
+    """
+    if dump_file is None:
+        return
+    try:
+        metrics.write(dump_file)
+    except OSError as e:
+        print(f"Failed to write Kite metrics to '{dump_file}': {str(e)}")
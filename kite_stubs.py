@@ -0,0 +1,265 @@
+"""
+Local stand-ins for the Kite clients so the trading engine can be run offline.
+"""
+import itertools
+import random
+import threading
+import time
+from kiteconnect import KiteConnect
+
+
+class ReplayTicker:
+    """
+    Stand-in for KiteTicker that replays recorded ticks through the same callbacks.
+    ticks is a list of batches, each batch a list of tick dicts with at least
+    "instrument_token" and "last_price". Only subscribed tokens are delivered.
+    disconnect_at lists batch indexes before which the connection drops; the
+    subscriptions are lost and on_reconnect/on_connect are called like KiteTicker does.
+    order_updates maps batch indexes to scripted order update dicts delivered through
+    on_order_update before that batch; push_order_update() delivers one immediately.
+    """
+    MODE_LTP = "ltp"
+    MODE_QUOTE = "quote"
+    MODE_FULL = "full"
+
+    def __init__(self, ticks, interval=0, disconnect_at=(), order_updates=None):
+        self.ticks = ticks
+        self.order_updates = order_updates or {}
+        self.interval = interval
+        self.disconnect_at = set(disconnect_at)
+        self.subscribed_tokens = {}
+        self.connected = False
+        self.reconnects = 0
+        self._stopped = threading.Event()
+        self.websocket_thread = None
+
+        self.on_connect = None
+        self.on_ticks = None
+        self.on_close = None
+        self.on_error = None
+        self.on_reconnect = None
+        self.on_noreconnect = None
+        self.on_order_update = None
+
+    def subscribe(self, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens.setdefault(token, self.MODE_QUOTE)
+        return True
+
+    def unsubscribe(self, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens.pop(token, None)
+        return True
+
+    def set_mode(self, mode, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens[token] = mode
+        return True
+
+    def is_connected(self):
+        return self.connected
+
+    def connect(self, threaded=False, disable_ssl_verification=False, proxy=None):
+        if threaded:
+            self.websocket_thread = threading.Thread(target=self._run, daemon=True)
+            self.websocket_thread.start()
+        else:
+            self._run()
+
+    def close(self, code=None, reason=None):
+        self._stopped.set()
+
+    def push_order_update(self, data):
+        if self.on_order_update:
+            self.on_order_update(self, data)
+
+    def _open(self):
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, {})
+
+    def _drop(self, code, reason):
+        self.connected = False
+        self.subscribed_tokens.clear()
+        if self.on_close:
+            self.on_close(self, code, reason)
+
+    def _run(self):
+        self._open()
+        for index, batch in enumerate(self.ticks):
+            if self._stopped.is_set():
+                break
+            if index in self.disconnect_at:
+                self._drop(1006, "Connection dropped by replay")
+                self.reconnects += 1
+                if self.on_reconnect:
+                    self.on_reconnect(self, self.reconnects)
+                self._open()
+            for data in self.order_updates.get(index, []):
+                self.push_order_update(data)
+            ticks = [tick for tick in batch if tick["instrument_token"] in self.subscribed_tokens]
+            if ticks and self.on_ticks:
+                self.on_ticks(self, ticks)
+            time.sleep(self.interval)
+        self._drop(1000, "Replay finished")
+        # The replay is over and will not reconnect, same as KiteTicker after its last retry
+        if self.on_noreconnect:
+            self.on_noreconnect(self)
+
+
+def ticks_from_prices(prices):
+    """
+    Builds ReplayTicker batches from {instrument_token: [price, price, ...]}, one batch per step.
+    """
+    steps = max((len(series) for series in prices.values()), default=0)
+    return [[{"instrument_token": token, "last_price": series[step]}
+             for token, series in prices.items() if step < len(series)]
+            for step in range(steps)]
+
+
+class StubKite:
+    """
+    In-memory stand-in for KiteConnect with the calls the trading engine makes.
+    Prices follow a seeded random walk that moves by up to step percent on every ltp call.
+    A fill_ratio share of the limit orders fill once the price crosses them; the rest
+    stay open until cancelled. Each instance has its own api_key, so it gets its
+    own rate limit buckets and cache entries like a separate account would.
+    """
+    VARIETY_REGULAR = KiteConnect.VARIETY_REGULAR
+    TRANSACTION_TYPE_BUY = KiteConnect.TRANSACTION_TYPE_BUY
+    TRANSACTION_TYPE_SELL = KiteConnect.TRANSACTION_TYPE_SELL
+    ORDER_TYPE_LIMIT = KiteConnect.ORDER_TYPE_LIMIT
+    PRODUCT_CNC = KiteConnect.PRODUCT_CNC
+    VALIDITY_DAY = KiteConnect.VALIDITY_DAY
+
+    instance_ids = itertools.count(1)
+
+    def __init__(self, prices=None, step=1.0, fill_ratio=1.0, seed=None, api_key=None, access_token="stub_token"):
+        self.api_key = api_key or f"stub_{next(self.instance_ids)}"
+        self.access_token = access_token
+        self.prices = dict(prices or {})
+        self.step = step
+        self.fill_ratio = fill_ratio
+        self.random = random.Random(seed)
+        self.order_book = {}
+        self.unfillable = set()
+        self.quantities = {}
+        self.order_ids = itertools.count(1)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+
+    def _count(self, endpoint):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def _price(self, symbol):
+        if symbol not in self.prices:
+            self.prices[symbol] = round(self.random.uniform(100, 3000), 2)
+        return self.prices[symbol]
+
+    def _tick(self, symbol):
+        """Moves the price of symbol one step and fills the open orders it crosses"""
+        price = self._price(symbol) * (1 + self.random.uniform(-self.step, self.step) / 100)
+        self.prices[symbol] = round(price, 2)
+        for order in self.order_book.values():
+            if order["tradingsymbol"] != symbol or order["status"] != "OPEN" or order["order_id"] in self.unfillable:
+                continue
+            if (order["transaction_type"] == "BUY" and price <= order["price"]) or (order["transaction_type"] == "SELL" and price >= order["price"]):
+                self._fill(order)
+
+    def _fill(self, order):
+        order["status"] = "COMPLETE"
+        order["filled_quantity"] = order["quantity"]
+        order["average_price"] = order["price"]
+        sign = 1 if order["transaction_type"] == "BUY" else -1
+        self.quantities[order["tradingsymbol"]] = self.quantities.get(order["tradingsymbol"], 0) + sign * order["quantity"]
+
+    def ltp(self, *instruments):
+        instruments = instruments[0] if len(instruments) == 1 and isinstance(instruments[0], list) else list(instruments)
+        with self.lock:
+            self._count("ltp")
+            quotes = {}
+            for instrument in instruments:
+                symbol = instrument.split(":", 1)[1]
+                self._tick(symbol)
+                quotes[instrument] = {"instrument_token": self.instrument_token(symbol), "last_price": self.prices[symbol]}
+            return quotes
+
+    def quote(self, *instruments):
+        instruments = instruments[0] if len(instruments) == 1 and isinstance(instruments[0], list) else list(instruments)
+        with self.lock:
+            self._count("quote")
+            quotes = {}
+            for instrument in instruments:
+                price = self._price(instrument.split(":", 1)[1])
+                quotes[instrument] = {"last_price": price, "ohlc": {"open": price, "high": price, "low": price, "close": price}}
+            return quotes
+
+    def instrument_token(self, symbol):
+        return sum(ord(character) * 31 ** index for index, character in enumerate(symbol)) % 10 ** 7
+
+    def instruments(self, exchange=None):
+        with self.lock:
+            self._count("instruments")
+            return [{"tradingsymbol": symbol, "instrument_token": self.instrument_token(symbol), "exchange": exchange or "NSE"}
+                    for symbol in self.prices]
+
+    def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, product, order_type, price=None, validity=None, **kwargs):
+        with self.lock:
+            self._count("place_order")
+            order_id = str(next(self.order_ids))
+            self.order_book[order_id] = {
+                "order_id": order_id, "tradingsymbol": tradingsymbol, "exchange": exchange,
+                "transaction_type": transaction_type, "quantity": quantity, "price": price,
+                "status": "OPEN", "filled_quantity": 0, "status_message": None,
+                "order_timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            if self.random.random() >= self.fill_ratio:
+                self.unfillable.add(order_id)
+            return order_id
+
+    def modify_order(self, variety, order_id, quantity=None, price=None, order_type=None, validity=None, **kwargs):
+        with self.lock:
+            self._count("modify_order")
+            order = self.order_book[order_id]
+            if order["status"] == "OPEN":
+                order["quantity"] = quantity if quantity is not None else order["quantity"]
+                order["price"] = price if price is not None else order["price"]
+            return order_id
+
+    def cancel_order(self, variety, order_id, **kwargs):
+        with self.lock:
+            self._count("cancel_order")
+            order = self.order_book[order_id]
+            if order["status"] == "OPEN":
+                order["status"] = "CANCELLED"
+            return order_id
+
+    def orders(self):
+        with self.lock:
+            self._count("orders")
+            return [dict(order) for order in self.order_book.values()]
+
+    def order_history(self, order_id):
+        with self.lock:
+            self._count("order_history")
+            return [dict(self.order_book[order_id])]
+
+    def holdings(self):
+        with self.lock:
+            self._count("holdings")
+            return [{"tradingsymbol": symbol, "quantity": quantity, "t1_quantity": 0}
+                    for symbol, quantity in self.quantities.items() if quantity]
+
+    def positions(self):
+        with self.lock:
+            self._count("positions")
+            positions = [{"tradingsymbol": symbol, "quantity": quantity, "t1_quantity": 0}
+                         for symbol, quantity in self.quantities.items()]
+            return {"day": positions, "net": positions}
+
+    def profile(self):
+        self._count("profile")
+        return {"user_id": self.api_key, "user_name": "Stub"}
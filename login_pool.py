@@ -0,0 +1,170 @@
+"""
+Concurrent Kite logins for many accounts from a small pool of reused headless Chrome instances.
+Every login borrows a browser from BrowserPool, which starts at most `size` of them and wipes the
+cookies and storage of a browser before handing it to the next account, so sessions never leak
+between accounts. login_all bounds the whole batch by one deadline and returns per-account timings.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from selenium import webdriver
+import browser_test
+import config
+
+KITE_ORIGINS = ("https://kite.zerodha.com", "https://kite.trade")
+
+
+def reset_driver(driver):
+    """Clears the cookies, cache and storage of a browser, so the next account starts from a clean session"""
+    try:
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in KITE_ORIGINS:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+    except Exception:
+        # Not a Chromium driver: fall back to what WebDriver itself can clear
+        driver.delete_all_cookies()
+    driver.get("about:blank")
+
+
+class BrowserPool:
+    """
+    Class to lend up to size Chrome drivers to concurrent logins.
+    Drivers are started on first demand and reused; a driver that failed is quit and replaced.
+    """
+    def __init__(self, size=config.login_browsers):
+        self.size = size
+        self.idle = []
+        self.started = 0
+        self.closed = False
+        self.drivers = []
+        # Notified whenever a driver goes idle or a slot frees up, so waiting logins can take it
+        self.available = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Returns an idle driver, starting one if fewer than size are running. Raises queue.Empty after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.available:
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if not self.closed and self.started < self.size:
+                    self.started += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self.closed or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self.available.wait(remaining)
+        try:
+            driver = webdriver.Chrome(options=browser_test.chrome_options())
+        except Exception:
+            with self.available:
+                self.started -= 1
+                self.available.notify()
+            raise
+        with self.available:
+            self.drivers.append(driver)
+        return driver
+
+    def release(self, driver, healthy=True):
+        """Gives a driver back, wiped for the next account, or quits it if it failed or the pool is closed"""
+        if healthy and not self.closed:
+            try:
+                reset_driver(driver)
+                with self.available:
+                    if not self.closed:
+                        self.idle.append(driver)
+                        self.available.notify()
+                        return
+            except Exception as e:
+                print(f"Failed to reset browser, replacing it: {str(e)}")
+        self.discard(driver)
+
+    def discard(self, driver):
+        """Quits a driver and frees its slot, so a waiting login starts a new one"""
+        with self.available:
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+                self.started -= 1
+                self.available.notify()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """Quits every driver, including ones still lent out, which makes their pending commands fail"""
+        with self.available:
+            self.closed = True
+            drivers, self.drivers = self.drivers, []
+            self.idle = []
+            self.started = 0
+            self.available.notify_all()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def login_all(user_ids, browsers=config.login_browsers, deadline=config.login_deadline, login=browser_test.login_with_driver):
+    """
+    Logs every account in concurrently on a BrowserPool of `browsers` Chrome instances, giving up after
+    `deadline` seconds in total. login(driver, user_id, deadline) performs one login and returns its token.
+    Returns (tokens, timings): {user_id: access token or None} and {user_id: {"status", "wait", "login", "total"}}
+    with "status" one of "ok", "failed" or "timeout" and times in seconds.
+    """
+    user_ids = list(user_ids)
+    start = time.monotonic()
+    end = start + deadline
+    tokens = {user_id: None for user_id in user_ids}
+    timings = {user_id: {"status": "timeout", "wait": None, "login": None, "total": None} for user_id in user_ids}
+    if not user_ids:
+        return tokens, timings
+
+    def log_in(user_id):
+        queued = time.monotonic()
+        try:
+            driver = pool.acquire(timeout=max(0, end - queued))
+        except queue.Empty:
+            return
+        except Exception as e:
+            print(f"{user_id}: Failed to start a browser: {str(e)}")
+            timings[user_id] = {"status": "failed", "wait": time.monotonic() - queued, "login": None, "total": time.monotonic() - start}
+            return
+        acquired = time.monotonic()
+        healthy = False
+        try:
+            tokens[user_id] = login(driver, user_id, end)
+            healthy = True
+        except Exception as e:
+            print(f"{user_id}: Login failed with an error: {str(e)}")
+        finally:
+            pool.release(driver, healthy)
+            finished = time.monotonic()
+            timings[user_id] = {"status": "ok" if tokens[user_id] else "failed", "wait": acquired - queued,
+                                "login": finished - acquired, "total": finished - start}
+
+    pool = BrowserPool(min(browsers, len(user_ids)))
+    executor = ThreadPoolExecutor(max_workers=len(user_ids), thread_name_prefix="login")
+    try:
+        futures = [executor.submit(log_in, user_id) for user_id in user_ids]
+        wait(futures, timeout=deadline)
+    finally:
+        # Logins still running past the deadline fail fast once their browsers are gone
+        pool.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for user_id in user_ids:
+        timing = timings[user_id]
+        total = f"{timing['total']:.1f} s" if timing["total"] is not None else f"> {deadline} s"
+        print(f"{user_id}: Login {timing['status']} in {total}")
+    # Copies, as logins abandoned at the deadline may still finish in the background
+    return dict(tokens), {user_id: dict(timing) for user_id, timing in timings.items()}
@@ -1,16 +1,23 @@
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
-import browser_test
+import access_tokens
 import config
+import async_trading
 import multiple_trading
 
 async def main():
+    if config.trading_mode == "async":
+        # Every account runs on one event loop; see async_trading.run_accounts
+        await async_trading.run_accounts(config.ID, config.shares_quantity, "NSE", 3)
+        return
+    # Expired accounts are logged in together from a shared browser pool, instead of each thread starting its own Chrome
+    access_tokens.refresh_access_tokens(config.ID)
     loop = asyncio.get_running_loop()
     with ThreadPoolExecutor() as pool:
         tasks = [
-            loop.run_in_executor(pool, multiple_trading.start_multiple_trading, user, config.shares_quantity, "NSE", 3)
+            loop.run_in_executor(pool, multiple_trading.start_multiple_trading, user, config.shares_quantity, "NSE", 3, config.trading_mode)
             for user in config.ID
         ]
         await asyncio.gather(*tasks)
 
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
@@ -1,150 +1,376 @@
-from kiteconnect import KiteConnect
-import browser_test
+from kiteconnect import KiteConnect, KiteTicker
+import access_tokens
 import kite_functions
+import grid_strategy
+from grid_book import GridBook
+import queue
+import threading
 import time
 from datetime import datetime, time as dt_time
 import config
-import excel_functions
+import kite_metrics
+import state_store
 
-base_price = {}
-number_of_trades = {}
-open_order = {}
-bool_for_symbol = {}
-
-
-"""Function to start the multiple trading process"""
-def multiple_trading(kite, user_id: str, symbols: dict, exchange: str, percent: int):
+def wait_for_market_open(user_id: str):
+    """Function to sleep until the market opens at 9:15 am"""
     now = datetime.now()
     start_time = dt_time(9, 15)
     if now.time() < start_time:
         wait_seconds = (datetime.combine(now.date(), start_time) - now).total_seconds()
         print(f"{user_id}: Waiting until 9:15 am to start trading... Sleeping for {int(wait_seconds)} seconds.")
         time.sleep(wait_seconds + 10)
-    print(f"{user_id}: Starting multiple trading process for {user_id}")
-    buy_trades = 0
-    sell_trades = 0
-    base_change = 0
-    excel_symbols = excel_functions.read_symbols(user_id)
-    for symbol in excel_symbols:
-        if symbol not in symbols.keys():
-            print(f"{user_id}: Symbol {symbol} not found in the config. Skipping...")
-            continue
-        if excel_functions.get_last_price_for_symbol(user_id, symbol) is None:
-            base_price[symbol] = kite_functions.get_current_price(kite, symbol, exchange)
-            number_of_trades[symbol] = 0
-        else:
-            base_price[symbol] = excel_functions.get_last_price_for_symbol(user_id, symbol)
-            number_of_trades[symbol] = excel_functions.get_lots_for_symbol(user_id, symbol)
-
-            
-    """Function to start the trading process"""
-    # Continuously monitor the stock price and place buy or sell orders based on market movement
-    while True:
-        current_time = datetime.now().time()
+
+
+def market_closed():
+    """Function to check if the trading day is over, from 3:29 pm"""
+    return datetime.now().time() >= dt_time(15, 29)
+
+
+class GridEngine(GridBook):
+    """
+    Class to run the grid strategy for one account.
+    Each engine owns its Kite client and the account's GridBook state, so any number of engines
+    can run side by side in one process.
+    start() loads the state, step() runs one polling cycle and stop() writes the day's summary;
+    run() and run_ticks() drive a whole trading day.
+    """
+    def __init__(self, kite, user_id: str, symbols: dict, exchange: str, percent: int, state=None):
+        # state is the user's state_store.open_user_state object; it is loaded from the configured backend if not given
+        super().__init__(user_id, state if state is not None else state_store.open_user_state(user_id), symbols, percent)
+        self.kite = kite
+        self.exchange = exchange
+        self.ticker = None
+        self.started = False
+        self.stopped = False
+        # Ticks and order updates queued by the ticker callbacks. The websocket thread is shared by the
+        # tickers of every engine in the process, so the callbacks only queue them and process_events
+        # applies them on the engine's own thread, where a REST call or throttle wait delays this account only.
+        self.events = queue.Queue()
+        # Held while the engine state changes, for callers driving the engine from other threads
+        self.lock = threading.RLock()
+
+    def load_trading_state(self):
+        """
+        Loads base price and number of trades of every symbol in the user's state.
+        Returns the list of symbols to trade.
+        """
+        missing_symbols = self.select_symbols()
+        self.load_symbols(missing_symbols, kite_functions.get_current_prices(self.kite, missing_symbols, self.exchange))
+        return self.trading_symbols
+
+    def roll_back_order(self, symbol: str, order: dict):
+        """
+        Rolls back the state change of a cancelled or rejected order.
+        A partially filled quantity is squared off with an opposite order.
+        """
+        square_off = self.square_off(symbol, order)
+        if square_off is not None:
+            side, quantity = square_off
+            square_off_price = kite_functions.get_current_price(self.kite, symbol, self.exchange)
+            kite_functions.place_order(self.kite, kite_functions.Order(symbol, self.exchange, quantity, square_off_price, side))
+            self.log(f"Placing square off {side.lower()} order for {symbol} at {square_off_price}")
+        current_price = kite_functions.get_current_price(self.kite, symbol, self.exchange) if self.roll_back_needs_price(symbol, order) else None
+        self.roll_back(symbol, order, current_price)
+
+    def reconcile_open_orders(self, min_age=0):
+        """
+        Checks every order placed at least min_age seconds ago in a single pass.
+        Completed orders are counted, unfilled ones are cancelled and their state change is rolled back.
+        The order book is fetched once up front and again after the cancellations until every cancelled order
+        has a final status, at most config.cancel_poll_attempts times, so a rollback reads a filled quantity that
+        can no longer change. An order still open after that is left for the next reconciliation.
+        """
+        due = self.due_orders(min_age)
+        if not due:
+            return
+        unfinished = self.record_completed_orders(due, kite_functions.get_order_book(self.kite))
+        if not unfinished:
+            return
+        for order_id in unfinished.values():
+            kite_functions.cancel_order(self.kite, order_id)
+
+        order_book = kite_functions.get_order_book(self.kite)
+        for _ in range(config.cancel_poll_attempts - 1):
+            if not self.cancel_pending(unfinished, order_book):
+                break
+            time.sleep(config.cancel_poll_interval)
+            order_book = kite_functions.get_order_book(self.kite)
+        for symbol, order in self.settle_cancelled_orders(unfinished, order_book).items():
+            self.roll_back_order(symbol, order)
+
+    def queued(self, handler):
+        """Returns a ticker callback that queues handler and its arguments for process_events instead of calling it"""
+        def callback(*args):
+            self.events.put((handler, args))
+        return callback
+
+    def process_events(self, timeout=0):
+        """
+        Applies the queued ticks and order updates on the calling thread, waiting up to timeout seconds
+        for the first one to arrive. Returns once the queue is empty.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                handler, args = self.events.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            # Later events are only taken if already queued
+            deadline = 0
+            try:
+                with self.lock:
+                    handler(*args)
+            except Exception as e:
+                self.log(f"Failed to apply a ticker event: {str(e)}")
+
+    def wait(self, seconds):
+        """Sleeps for seconds while applying the ticks and order updates that arrive meanwhile"""
+        end = time.monotonic() + seconds
+        while (remaining := end - time.monotonic()) > 0:
+            self.process_events(timeout=remaining)
+
+    def order_update_stream(self):
+        """
+        Builds the OrderUpdateStream that queues pushed order updates for process_events.
+        Updates for orders that are no longer open (e.g. already reconciled) are ignored.
+        """
+        def on_complete(order):
+            symbol = self.symbol_of(order["order_id"])
+            if symbol is not None:
+                self.record_completed_order(symbol, order)
+
+        def on_cancelled(order):
+            symbol = self.symbol_of(order["order_id"])
+            if symbol is not None:
+                print(f"{self.user_id}: Order {order['order_id']} for {symbol} {order['status'].lower()}: {order.get('status_message')}")
+                self.roll_back_order(symbol, order)
+
+        def on_partial_fill(order):
+            print(f"{self.user_id}: Order {order['order_id']} for {order['tradingsymbol']} filled {order['filled_quantity']}/{order['quantity']}")
+
+        return kite_functions.OrderUpdateStream(self.queued(on_complete), self.queued(on_cancelled), self.queued(on_cancelled), on_partial_fill)
+
+    def process_price(self, symbol: str, current_price):
+        """
+        Applies the grid rules to one symbol at current_price and places the resulting order.
+        Used by both the polling loop and the tick-driven engine.
+        """
+        action = self.decide(symbol, current_price, lambda: kite_functions.get_nifty_day_change(self.kite))
+        side = self.order_side(action)
+        order_id = None
+        if side is not None:
+            self.log_action(symbol, action, current_price)
+            order_id = kite_functions.place_order(self.kite, kite_functions.Order(symbol, self.exchange, self.symbols[symbol], current_price, side))
+        if action is not None:
+            self.apply_action(symbol, action, order_id)
+
+    def take_over_open_orders(self):
+        """Reconciles the orders an earlier run of the account left open, e.g. before a crash, before trading starts"""
+        if self.adopt_open_orders(kite_functions.get_order_book(self.kite).values()):
+            self.reconcile_open_orders()
+
+    def start(self, ticker=None):
+        """
+        Loads the trading state. Order updates are taken from ticker, or from a KiteTicker
+        opened when config.push_order_updates is set.
+        """
+        print(f"{self.user_id}: Starting multiple trading process for {self.user_id}")
+        self.load_trading_state()
+        self.take_over_open_orders()
+        if ticker is None and config.push_order_updates:
+            ticker = KiteTicker(self.kite.api_key, self.kite.access_token)
+        if ticker is not None:
+            # Only order updates are needed from the ticker, so nothing is subscribed
+            self.ticker = ticker
+            self.order_update_stream().attach(ticker)
+            ticker.connect(threaded=True)
+        self.started = True
+
+    def step(self):
+        """Runs one polling cycle: reconcile open orders, then evaluate every symbol against one price snapshot"""
         time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if current_time.hour >= 15 and current_time.minute > 28:
-            print(f"{user_id}: Market closed. Exiting...")
-            print(user_id + " trading orders:")   
-            print(f"{user_id}: {time_now}: Total buy trades: {buy_trades}")
-            print(f"{user_id}: {time_now}: Total sell trades: {sell_trades}")
-            print(f"{user_id}: {time_now}: Total base changes: {base_change}")
-            excel_functions.append_trading_orders(user_id, buy_trades, sell_trades, base_change)
-            break
-        if buy_trades >= 50: 
-            print(f"{user_id}: {time_now}: Total buy trades reached 50. No more buying will be done.")
-        print(f"{user_id}: {time_now}: Checking price...")
-
-        for key, value in open_order.items():
-            time.sleep(2)
-            order_status = kite_functions.check_if_order_status_complete(kite, value)
-            if order_status:
-                print(f"{user_id}: {time_now}: Order for {key} completed. Deleting order id {value}")
-                if kite_functions.get_order_side(kite, value) == "SELL":
-                    excel_functions.upsert_symbol_row(user_id, key, number_of_trades[key], base_price[key])
-                    sell_trades += 1
-                else:
-                    buy_trades += 1
-            else:
-                kite_functions.cancel_order(kite, value)
-                filled_quantity = kite_functions.get_filled_quantity(kite, value)
-                if kite_functions.get_order_side(kite, value) == "BUY":
-                    if filled_quantity > 0 and filled_quantity < symbols[key]:
-                        square_off_sell_order = kite_functions.Order(key, exchange, filled_quantity, kite_functions.get_current_price(kite, key, "NSE"), "SELL")
-                        kite_functions.place_order(kite, square_off_sell_order)
-                        print(f"{user_id}: {time_now}: Placing square off sell order for {key} at {kite_functions.get_current_price(kite, key, 'NSE')}")
-
-                    number_of_trades[key] -= 1
-                    if number_of_trades[key] == 0:
-                        base_price[key] = kite_functions.get_current_price(kite, key, exchange)
-                    else:
-                        base_price[key] = base_price[key]*100/(100-percent)
+        if self.trade_counts["buy_trades"] >= grid_strategy.DAILY_BUY_CAP:
+            print(f"{self.user_id}: {time_now}: Total buy trades reached {grid_strategy.DAILY_BUY_CAP}. No more buying will be done.")
+        print(f"{self.user_id}: {time_now}: Checking price...")
+        self.process_events()
+
+        # Evaluate every symbol against one consistent price snapshot for this cycle
+        prices = kite_functions.get_current_prices(self.kite, self.trading_symbols, self.exchange)
+        with self.lock:
+            self.reconcile_open_orders()
+            for symbol in self.trading_symbols:
+                current_price = prices.get(symbol)
+                if current_price is not None:
+                    self.process_price(symbol, current_price)
                 else:
-                    if filled_quantity > 0 and filled_quantity < symbols[key]:
-                        square_off_buy_order = kite_functions.Order(key, exchange, filled_quantity, kite_functions.get_current_price(kite, key, "NSE"), "BUY")
-                        kite_functions.place_order(kite, square_off_buy_order)
-                        print(f"{user_id}: {time_now}: Placing square off buy order for {key} at {kite_functions.get_current_price(kite, key, 'NSE')}")
-
-                    number_of_trades[key] += 1
-                    base_price[key] = base_price[key]*(100-percent)/100
-                excel_functions.upsert_symbol_row(user_id, key, number_of_trades[key], base_price[key])
-                print(f"{user_id}: {time_now}: Order for {key} cancelled. Changing base price to {base_price[key]}")
-        open_order.clear()
-        for symbol in excel_symbols:
-            time.sleep(0.15)
-            current_price = kite_functions.get_current_price(kite, symbol, exchange)
-            order_id = None
-            if current_price is not None:
-                time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                # Place the first buy order if no trades have been made yet
-                if number_of_trades[symbol] == 0:
-                    time.sleep(1)
-                    buy_order = kite_functions.Order(symbol, exchange, symbols[symbol], current_price, "BUY")
-                    print(f"{user_id}: {time_now}: Placing first buy order for {symbol} at {current_price}")
-                    order_id = kite_functions.place_order(kite, buy_order)
-                    if order_id is not None:
-                        number_of_trades[symbol] += 1
-                        excel_functions.upsert_symbol_row(user_id, symbol, number_of_trades[symbol], base_price[symbol])
-                # If current price is less than the base price by 3% and number of trades are less than 5, place a buy order
-                elif current_price <= base_price[symbol]*(100-percent)/100 and number_of_trades[symbol] < 5 and buy_trades < 50 and kite_functions.get_nifty_day_change(kite) > -4: 
-                    print(f"{user_id}: {time_now}: Target buy price {current_price} for {symbol} reached. Placing buy order... Current number of trades = {number_of_trades[symbol]+1}")
-                    buy_order = kite_functions.Order(symbol, exchange, symbols[symbol], current_price, "BUY") 
-                    order_id = kite_functions.place_order(kite, buy_order)
-                    if order_id is not None:
-                        base_price[symbol] = base_price[symbol]*(100-percent)/100
-                        number_of_trades[symbol] += 1
-                        excel_functions.upsert_symbol_row(user_id, symbol, number_of_trades[symbol], base_price[symbol])
-                # If current price is greater than the base price by 3% and number of trades are greater than 1, place a sell order
-                elif current_price >= base_price[symbol]*100/(100-percent) and number_of_trades[symbol] > 1:
-                    print(f"{user_id}: {time_now}: Target sell price {current_price} for {symbol} reached. Placing sell order... Current number of trades = {number_of_trades[symbol]-1}")
-                    sell_order = kite_functions.Order(symbol, exchange, symbols[symbol], current_price, "SELL") 
-                    order_id = kite_functions.place_order(kite, sell_order)
-                    if order_id is not None:
-                        base_price[symbol] = base_price[symbol]*100/(100-percent)
-                        number_of_trades[symbol] =  number_of_trades[symbol] - 1
-                        excel_functions.upsert_symbol_row(user_id, symbol, number_of_trades[symbol] - 1, base_price[symbol]*100/(100-percent))
-                # If current price is greater than the base price by 3% and number of trades are equal to 1, update the base price
-                elif current_price >= base_price[symbol]*100/(100-percent):
-                    base_change = base_change + 1
-                    base_price[symbol] = base_price[symbol]*100/(100-percent)
-                    excel_functions.upsert_symbol_row(user_id, symbol, number_of_trades[symbol], base_price[symbol])
-                    print(f"{user_id}: {time_now}: Changing base price for {symbol} to {base_price[symbol]}")
-
-                if order_id is not None:
-                    open_order[symbol] = order_id
-            else:
-                print(f"{user_id}: {time_now}: Failed to fetch current price for {symbol}. Retrying...")
-            
-        time.sleep(10)
-
-def start_multiple_trading(user_id: str, symbols: dict, exchange: str, percent: int):
+                    print(f"{self.user_id}: {time_now}: Failed to fetch current price for {symbol}. Retrying...")
+            self.state.end_cycle()
+
+    def stop(self, reconcile=False):
+        """
+        Closes the ticker, optionally reconciles the remaining open orders, and writes the day's summary and state.
+        Safe to call more than once.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.ticker is not None:
+            self.ticker.close()
+        with self.lock:
+            if reconcile:
+                self.reconcile_open_orders()
+            self.close_trading_day()
+
+    def close_trading_day(self):
+        """Function to flush the user's state and store the day's trade summary"""
+        self.state.close()
+        time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{self.user_id}: Market closed. Exiting...")
+        print(self.user_id + " trading orders:")
+        print(f"{self.user_id}: {time_now}: Total buy trades: {self.trade_counts['buy_trades']}")
+        print(f"{self.user_id}: {time_now}: Total sell trades: {self.trade_counts['sell_trades']}")
+        print(f"{self.user_id}: {time_now}: Total base changes: {self.trade_counts['base_change']}")
+        state_store.append_trading_orders(self.user_id, self.trade_counts["buy_trades"], self.trade_counts["sell_trades"], self.trade_counts["base_change"])
+        kite_metrics.write_dump()
+
+    def run(self, ticker=None):
+        """Polls prices every config.cycle_interval seconds from market open until market close"""
+        wait_for_market_open(self.user_id)
+        try:
+            self.start(ticker)
+            # Continuously monitor the stock price and place buy or sell orders based on market movement
+            while not market_closed():
+                cycle_start = time.monotonic()
+                try:
+                    self.step()
+                except Exception as e:
+                    # A failed price fetch, quote or order book read only costs this cycle, not the trading day
+                    self.log(f"Polling cycle failed: {str(e)}. Retrying next cycle...")
+                # API pacing is left to the rate limiter; this only waits out the rest of the cycle
+                self.wait(config.cycle_interval - (time.monotonic() - cycle_start))
+            self.stop()
+        finally:
+            if self.ticker is not None:
+                self.ticker.close()
+            # Write pending state even if the loop stops on an error
+            self.state.close()
+
+    def run_ticks(self, ticker=None, reconcile_interval=config.cycle_interval):
+        """
+        Trades on the Kite streaming feed from market open until market close.
+        Every symbol is subscribed in LTP mode and the grid rules run on each incoming tick.
+        Ticks and order updates pushed on the same connection are queued by the ticker callbacks and
+        applied as they arrive on the calling thread, which also reconciles the orders still open every
+        reconcile_interval seconds.
+        A ticker can be passed in, e.g. a kite_stubs.ReplayTicker to run offline.
+        """
+        wait_for_market_open(self.user_id)
+        print(f"{self.user_id}: Starting tick-driven trading process for {self.user_id}")
+        self.load_trading_state()
+        self.take_over_open_orders()
+        tokens = kite_functions.get_instrument_tokens(self.kite, self.trading_symbols, self.exchange)
+        token_symbols = {token: symbol for symbol, token in tokens.items()}
+        if ticker is None:
+            ticker = KiteTicker(self.kite.api_key, self.kite.access_token)
+        self.ticker = ticker
+
+        feed_closed = threading.Event()
+
+        def on_connect(ws, response):
+            # Called on every (re)connection, so the subscription is restored after a reconnect
+            print(f"{self.user_id}: Ticker connected. Subscribing to {len(tokens)} symbols")
+            ws.subscribe(list(tokens.values()))
+            ws.set_mode(ws.MODE_LTP, list(tokens.values()))
+
+        def on_ticks(ws, ticks):
+            for tick in ticks:
+                symbol = token_symbols.get(tick["instrument_token"])
+                # process_price waits for the open order of a symbol to be reconciled before trading it again
+                if symbol is None:
+                    continue
+                self.process_price(symbol, tick["last_price"])
+
+        def on_close(ws, code, reason):
+            print(f"{self.user_id}: Ticker connection closed: {code} - {reason}")
+
+        def on_error(ws, code, reason):
+            print(f"{self.user_id}: Ticker error: {code} - {reason}")
+
+        def on_reconnect(ws, attempts_count):
+            print(f"{self.user_id}: Reconnecting ticker, attempt {attempts_count}...")
+
+        def on_noreconnect(ws):
+            print(f"{self.user_id}: Ticker gave up reconnecting.")
+            feed_closed.set()
+
+        ticker.on_connect = on_connect
+        ticker.on_ticks = self.queued(on_ticks)
+        ticker.on_close = on_close
+        ticker.on_error = on_error
+        ticker.on_reconnect = on_reconnect
+        # Queued too, so the loop below sees the feed closed only after the ticks before it were applied
+        ticker.on_noreconnect = self.queued(on_noreconnect)
+        self.order_update_stream().attach(ticker)
+        ticker.connect(threaded=True)
+        self.started = True
+
+        try:
+            next_reconcile = time.monotonic() + reconcile_interval
+            while not market_closed() and not feed_closed.is_set():
+                self.process_events(timeout=next_reconcile - time.monotonic())
+                if time.monotonic() < next_reconcile:
+                    continue
+                next_reconcile = time.monotonic() + reconcile_interval
+                try:
+                    with self.lock:
+                        # An order placed by a tick just before this wake-up gets a full interval to fill
+                        self.reconcile_open_orders(min_age=reconcile_interval)
+                        self.state.end_cycle()
+                except Exception as e:
+                    self.log(f"Reconciliation failed: {str(e)}. Retrying next cycle...")
+            self.stop(reconcile=True)
+        finally:
+            # Write pending state even if the loop stops on an error
+            self.state.close()
+
+
+def multiple_trading(kite, user_id: str, symbols: dict, exchange: str, percent: int, state=None, ticker=None):
+    """
+    Function to start the multiple trading process, polling prices every cycle.
+    state is the user's state_store.open_user_state object; it is loaded from the configured backend if not given.
+    Order updates are taken from ticker, or from a KiteTicker opened when config.push_order_updates is set.
+    """
+    engine = GridEngine(kite, user_id, symbols, exchange, percent, state)
+    engine.run(ticker)
+    return engine
+
+
+def multiple_trading_ticks(kite, user_id: str, symbols: dict, exchange: str, percent: int, state=None, ticker=None, reconcile_interval=config.cycle_interval):
+    """
+    Function to start the multiple trading process driven by the Kite streaming feed.
+    See GridEngine.run_ticks.
+    """
+    engine = GridEngine(kite, user_id, symbols, exchange, percent, state)
+    engine.run_ticks(ticker, reconcile_interval)
+    return engine
+
+
+def start_multiple_trading(user_id: str, symbols: dict, exchange: str, percent: int, mode=config.trading_mode):
     """
     Function to start the multiple trading process for a given set of symbols and exchange.
+    mode is "poll" to poll prices every cycle or "ticks" to trade on the streaming feed.
     """
-    kite = KiteConnect(api_key=config.config_keys[user_id]["api_key"])
-    kite.set_access_token(excel_functions.get_access_token(user_id))
-    browser_test.generate_automated_access_token(user_id)
-    time.sleep(2)
-    multiple_trading(kite, user_id, symbols, exchange, percent)
+    # Read symbols, lots, last prices and the access token in one pass over the user's state
+    user_state = state_store.load_user_state(user_id)
+    kite = kite_metrics.instrument(KiteConnect(api_key=config.config_keys[user_id]["api_key"]))
+    kite_metrics.start_dump()
+    # The stored token is reused if Kite still accepts it; the browser login only runs when it does not
+    access_tokens.ensure_access_token(kite, user_id, user_state["access_token"])
+    state = state_store.open_user_state(user_id, loaded=user_state)
+    if mode == "ticks":
+        multiple_trading_ticks(kite, user_id, symbols, exchange, percent, state)
+    else:
+        multiple_trading(kite, user_id, symbols, exchange, percent, state)
 
 
 if __name__ == '__main__':
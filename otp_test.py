@@ -1,33 +1,64 @@
+import importlib.util
+import os
+import sys
+import time
 import pyotp
-import subprocess
 from urllib.parse import urlparse, parse_qs
+import config
 
-def run_parser(qrlink):
+# The decoder imports its enums and protobuf modules from its src directory, which is appended so those
+# generic names never shadow an installed module; decoder itself is loaded under a name of its own
+DECODER_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "otpauth-migration-decoder", "src")
+if DECODER_SRC not in sys.path:
+    sys.path.append(DECODER_SRC)
+_spec = importlib.util.spec_from_file_location("otpauth_migration_decoder", os.path.join(DECODER_SRC, "decoder.py"))
+decoder = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = decoder
+_spec.loader.exec_module(decoder)
 
-    command = [
-        "python", "./otpauth-migration-decoder/src/decoder.py", "decode",
-        "--migration", qrlink
-    ]
+TOTP_INTERVAL = 30
 
-    # Run the command and capture output
-    result = subprocess.run(command, capture_output=True, text=True)
 
-    # Get stdout and stderr
-    output = result.stdout.strip()
-    error = result.stderr.strip()
+def decode_secret(qrlink):
+    """Returns the base32 TOTP secret of the first account in an otpauth-migration link"""
+    output = decoder.decode_migration(qrlink)[0]
+    return parse_qs(urlparse(output).query)["secret"][0]
 
-    # Print or use the output
-    if result.returncode == 0:
-        print("Decoder Output:\n", output)
-    else:
-        print("Error:\n", error)
 
+def load_secrets():
+    """Decodes the TOTP secret of every account in config.config_keys, keyed by QR link"""
+    loaded = {}
+    for user_id, keys in config.config_keys.items():
+        if not keys.get("qr_link"):
+            continue
+        try:
+            loaded[keys["qr_link"]] = decode_secret(keys["qr_link"])
+        except Exception as e:
+            print(f"{user_id}: Failed to decode the QR link: {str(e)}")
+    return loaded
 
-    parsed = urlparse(output)
-    query_params = parse_qs(parsed.query)
 
-    secret = query_params.get("secret", [None])[0]
-    print("Secret:", secret)
+# Decoded once when the module is imported, so logins only generate codes
+totp_secrets = load_secrets()
 
-    totp = pyotp.TOTP(secret)
-    return totp.now()
\ No newline at end of file
+
+def get_secret(qrlink):
+    secret = totp_secrets.get(qrlink)
+    if secret is None:
+        secret = totp_secrets[qrlink] = decode_secret(qrlink)
+    return secret
+
+
+def run_parser(qrlink, min_validity=None):
+    """
+    Returns the current TOTP code of the account in qrlink.
+    If the code expires in less than min_validity seconds (config.totp_min_validity by default), waits for the next 30 second window
+    first, so the code is not rejected by the time the login form is submitted.
+    """
+    min_validity = config.totp_min_validity if min_validity is None else min_validity
+    totp = pyotp.TOTP(get_secret(qrlink), interval=TOTP_INTERVAL)
+    remaining = TOTP_INTERVAL - time.time() % TOTP_INTERVAL
+    if remaining < min_validity:
+        # A little past the boundary, so now() is already in the next window
+        time.sleep(remaining + 0.1)
+    return totp.now()
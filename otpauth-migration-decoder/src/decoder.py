@@ -1,12 +1,20 @@
+import json
+import os
 from base64 import (
     b32encode,
     b64decode,
 )
-from collections.abc import Generator
+from collections.abc import (
+    Generator,
+    Iterable,
+    Iterator,
+)
+from concurrent.futures import ProcessPoolExecutor
 from typing import (
     Any,
     Dict,
     List,
+    Optional,
     Union,
 )
 from urllib.parse import (
@@ -18,9 +26,6 @@ from urllib.parse import (
 )
 
 import click
-from PIL import Image
-from pyzbar.pyzbar import decode as pyzbar_decode
-from pyzbar.pyzbar_error import PyZbarError
 
 from enums import (
     Algorithm,
@@ -35,6 +40,10 @@ HOSTNAME = 'offline'
 PAYLOAD_MARK = 'data'
 EXAMPLE_PAYLOAD = 'CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC'
 EXAMPLE_MIGRATION = f'{SCHEME}://{HOSTNAME}?{PAYLOAD_MARK}={EXAMPLE_PAYLOAD}'
+IMAGE_EXTENSIONS = {'.bmp', '.gif', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp'}
+
+# Parsed into by every image a worker process extracts
+worker_payload = Payload()
 
 
 def is_migration_incorrect(
@@ -83,16 +92,109 @@ def get_otpauth_url(otp: Payload.OtpParameters) -> str:
     return f'otpauth://{otp_type}/{otp_name}?{otp_params}'
 
 
-def validate_migration(ctx: click.Context, param: click.Option, migration: str) -> list[str]:
+def get_migration_data(migration: str) -> list[str]:
     url: ParseResult = urlparse(migration)
     qs: Dict[str, Any] = parse_qs(url.query)
 
     if is_migration_incorrect(parsed_url=url, parsed_qs=qs):
-        raise click.BadParameter(f'migration must be like "{EXAMPLE_MIGRATION}"')
+        raise ValueError(f'migration must be like "{EXAMPLE_MIGRATION}"')
 
     return qs[PAYLOAD_MARK]
 
 
+def validate_migration(ctx: click.Context, param: click.Option, migration: str) -> list[str]:
+    try:
+        return get_migration_data(migration)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+def validate_migrations(
+        ctx: click.Context,
+        param: click.Option,
+        migrations: tuple[str, ...],
+) -> list[tuple[str, list[str]]]:
+    return [(migration, validate_migration(ctx, param, migration)) for migration in migrations]
+
+
+def otpauth_urls(migration_data: list[str], migration_payload: Optional[Payload] = None) -> list[str]:
+    """Convert payloads of an otpauth-migration link to otpauth links, parsing them all into one Payload message"""
+    migration_payload = migration_payload if migration_payload is not None else Payload()
+    urls = []
+
+    for payload in decoded_data(data=migration_data):
+        migration_payload.ParseFromString(payload)
+        urls.extend(get_otpauth_url(otp_item) for otp_item in migration_payload.otp_parameters)
+
+    return urls
+
+
+def decode_migration(migration: str, migration_payload: Optional[Payload] = None) -> list[str]:
+    """Convert an otpauth-migration link to plain otpauth links, raising ValueError if it is malformed"""
+
+    return otpauth_urls(get_migration_data(migration), migration_payload)
+
+
+def read_migrations(filename: str) -> list[str]:
+    with open(filename) as migrations_file:
+        return [line.strip() for line in migrations_file if line.strip()]
+
+
+def collect_images(paths: Iterable[str]) -> list[str]:
+    """Expand directories to the image files they contain, keeping files as given"""
+    images = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in sorted(os.walk(path)):
+                images.extend(
+                    os.path.join(root, filename)
+                    for filename in sorted(filenames)
+                    if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+                )
+        else:
+            images.append(path)
+
+    return images
+
+
+def extract_image(filename: str) -> dict[str, Any]:
+    """Read the QR codes of one image, decoding the otpauth-migration links found in them"""
+    # Imported here, so that decoding links does not load the image libraries
+    from PIL import (
+        Image,
+        UnidentifiedImageError,
+    )
+    from pyzbar.pyzbar import decode as pyzbar_decode
+    from pyzbar.pyzbar_error import PyZbarError
+
+    try:
+        with Image.open(filename) as qr_code_image:
+            data = [str(item.data, 'utf-8') for item in pyzbar_decode(qr_code_image)]
+    except (PyZbarError, UnidentifiedImageError, OSError):
+        return {'file': filename, 'error': 'Unsupported image format'}
+
+    result: dict[str, Any] = {'file': filename, 'data': data, 'otpauth': []}
+    for migration in data:
+        try:
+            result['otpauth'].extend(decode_migration(migration, worker_payload))
+        except ValueError:
+            pass
+
+    return result
+
+
+def extract_images(filenames: list[str], workers: Optional[int] = None) -> Iterator[dict[str, Any]]:
+    """Extract the images on a process pool, yielding the results in the order of filenames"""
+    if len(filenames) <= 1 or workers == 1:
+        yield from map(extract_image, filenames)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(extract_image, filenames, chunksize=max(1, len(filenames) // (workers * 4)))
+
+
 @click.group()
 def cli():
     """otpauth-migration decoder"""
@@ -101,39 +203,83 @@ def cli():
 @cli.command()
 @click.option(
     '--migration',
-    'migration_data',
+    'migrations',
     type=click.UNPROCESSED,
-    callback=validate_migration,
-    help='otpauth-migration link text',
+    multiple=True,
+    callback=validate_migrations,
+    help='otpauth-migration link text, can be repeated',
+)
+@click.option(
+    '--file',
+    'filenames',
+    type=click.Path(exists=True, dir_okay=False),
+    multiple=True,
+    help='file with one otpauth-migration link per line, can be repeated',
 )
-def decode(migration_data: list[str]):
+@click.option(
+    '--json',
+    'json_lines',
+    is_flag=True,
+    help='print one JSON object per link',
+)
+def decode(migrations: list[tuple[str, list[str]]], filenames: tuple[str, ...], json_lines: bool):
     """Convert Google Authenticator data to plain otpauth links"""
-
-    for payload in decoded_data(data=migration_data):
-        migration_payload = Payload()
-        migration_payload.ParseFromString(payload)
-
-        for otp_item in migration_payload.otp_parameters:
-            print(get_otpauth_url(otp_item))
+    migration_payload = Payload()
+    items: list[tuple[str, Optional[list[str]]]] = list(migrations)
+
+    for filename in filenames:
+        for migration in read_migrations(filename):
+            try:
+                items.append((migration, get_migration_data(migration)))
+            except ValueError:
+                items.append((migration, None))
+
+    for source, migration_data in items:
+        if migration_data is None:
+            if json_lines:
+                click.echo(json.dumps({'migration': source, 'error': 'Incorrect migration'}))
+            else:
+                click.echo(f'Incorrect migration: {source}', err=True)
+            continue
+
+        urls = otpauth_urls(migration_data, migration_payload)
+        if json_lines:
+            click.echo(json.dumps({'migration': source, 'otpauth': urls}))
+        else:
+            for url in urls:
+                click.echo(url)
 
 
 @cli.command()
 @click.option(
     '--file',
-    'filename',
+    'paths',
     type=click.Path(exists=True),
-    help='file name or path with file name'
+    multiple=True,
+    help='image file or directory of images, can be repeated'
 )
-def extract(filename: str):
-    """Extract otpauth-migration from qr-code image"""
-    with Image.open(filename) as qr_code_image:
-        try:
-            data = pyzbar_decode(qr_code_image)
-        except PyZbarError:
-            click.echo('Unsupported image format')
-
-        for item in data:
-            click.echo(item.data)
+@click.option(
+    '--workers',
+    type=int,
+    default=None,
+    help='processes decoding images, all cores by default',
+)
+@click.option(
+    '--json',
+    'json_lines',
+    is_flag=True,
+    help='print one JSON object per image',
+)
+def extract(paths: tuple[str, ...], workers: Optional[int], json_lines: bool):
+    """Extract otpauth-migration from qr-code images"""
+    for result in extract_images(collect_images(paths), workers):
+        if json_lines:
+            click.echo(json.dumps(result))
+        elif 'error' in result:
+            click.echo(result['error'])
+        else:
+            for item in result['data']:
+                click.echo(item)
 
 
 if __name__ == '__main__':
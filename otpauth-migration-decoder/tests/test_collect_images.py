@@ -0,0 +1,22 @@
+import os
+
+from src.decoder import collect_images
+
+
+def test_collect_images(tmp_path):
+    # arrange
+    (tmp_path / 'sub').mkdir()
+    for name in ('b.png', 'a.JPG', 'notes.txt', os.path.join('sub', 'c.jpeg')):
+        (tmp_path / name).write_bytes(b'')
+    single_file = str(tmp_path / 'notes.txt')
+
+    # act
+    result = collect_images([str(tmp_path), single_file])
+
+    # assert
+    assert result == [
+        str(tmp_path / 'a.JPG'),
+        str(tmp_path / 'b.png'),
+        str(tmp_path / 'sub' / 'c.jpeg'),
+        single_file,
+    ]
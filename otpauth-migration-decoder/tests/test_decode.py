@@ -0,0 +1,35 @@
+import json
+
+from click.testing import CliRunner
+
+from src.decoder import decode
+
+
+MIGRATION = 'otpauth-migration://offline?data=CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC'
+OTPAUTH_URL = 'otpauth://totp/Example%3Aalice%40google.com?issuer=Example&secret=JBSWY3DPEHPK3PXP'
+
+
+def test_decode__migration__ok():
+    # act
+    result = CliRunner().invoke(decode, ['--migration', MIGRATION])
+
+    # assert
+    assert result.exit_code == 0
+    assert result.output == f'{OTPAUTH_URL}\n'
+
+
+def test_decode__batch__json_lines(tmp_path):
+    # arrange
+    migrations_file = tmp_path / 'migrations.txt'
+    migrations_file.write_text(f'{MIGRATION}\nbroken\n\n')
+
+    # act
+    result = CliRunner().invoke(decode, ['--migration', MIGRATION, '--file', str(migrations_file), '--json'])
+
+    # assert
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [
+        {'migration': MIGRATION, 'otpauth': [OTPAUTH_URL]},
+        {'migration': MIGRATION, 'otpauth': [OTPAUTH_URL]},
+        {'migration': 'broken', 'error': 'Incorrect migration'},
+    ]
@@ -0,0 +1,27 @@
+import pytest
+
+from src.decoder import decode_migration
+
+
+def test_decode_migration__migration__ok():
+    # arrange
+    migration = 'otpauth-migration://offline?data=CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC'
+
+    # act
+    result = decode_migration(migration)
+
+    # assert
+    assert result == ['otpauth://totp/Example%3Aalice%40google.com?issuer=Example&secret=JBSWY3DPEHPK3PXP']
+
+
+@pytest.mark.parametrize(
+    'broken_migration',
+    [
+        'otpauth-migration://online?data=CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC',
+        'data=CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC',
+    ]
+)
+def test_decode_migration__broken_migration__raise(broken_migration):
+    # act & assert
+    with pytest.raises(ValueError):
+        decode_migration(broken_migration)
@@ -0,0 +1,17 @@
+from src.decoder import otpauth_urls
+from src.protobuf.otpauth_migration_pb2 import Payload
+
+
+def test_otpauth_urls__reused_payload():
+    # arrange
+    migration_data = ['CjEKCkhlbGxvId6tvu8SGEV4YW1wbGU6YWxpY2VAZ29vZ2xlLmNvbRoHRXhhbXBsZTAC']
+    migration_payload = Payload()
+
+    # act
+    first = otpauth_urls(migration_data, migration_payload)
+    second = otpauth_urls(migration_data * 2, migration_payload)
+
+    # assert
+    expected = 'otpauth://totp/Example%3Aalice%40google.com?issuer=Example&secret=JBSWY3DPEHPK3PXP'
+    assert first == [expected]
+    assert second == [expected, expected]
@@ -0,0 +1,90 @@
+"""
+Token-bucket rate limiting for Kite API calls.
+Kite enforces its limits per API key and per kind of endpoint, so there is one bucket per
+account and category ("quote", "order", "other"), shared by every thread in the process.
+"""
+import asyncio
+import threading
+import time
+import config
+import kite_metrics
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most capacity tokens.
+    acquire() takes a token and sleeps only as long as needed for it to become available;
+    waiting callers are served in the order they arrived. acquire_async() does the same
+    without blocking the event loop, drawing from the same budget.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve the token now; a negative balance is the time still owed to earlier callers
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def try_acquire(self):
+        """Takes a token only if one is available now. Returns whether it did."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+buckets = {}
+buckets_lock = threading.Lock()
+
+
+def get_bucket(account: str, category: str):
+    """
+    Returns the shared bucket of an account for a category, creating it from config.rate_limits.
+    Its burst is one second of calls, and at least one call, so it never exceeds what Kite's own one second window allows.
+    """
+    key = (account, category)
+    with buckets_lock:
+        bucket = buckets.get(key)
+        if bucket is None:
+            rate = config.rate_limits[category]
+            bucket = buckets[key] = TokenBucket(rate, max(1, rate))
+        return bucket
+
+
+def throttle(kite, category: str):
+    """Blocks until the account of the kite client may make one more call in category"""
+    wait = get_bucket(getattr(kite, "api_key", str(id(kite))), category).acquire()
+    kite_metrics.record_throttle(kite, category, wait)
+    return wait
+
+
+async def throttle_async(kite, category: str):
+    """Waits, without blocking the event loop, until the account may make one more call in category"""
+    wait = await get_bucket(getattr(kite, "api_key", str(id(kite))), category).acquire_async()
+    kite_metrics.record_throttle(kite, category, wait)
+    return wait
@@ -0,0 +1,164 @@
+"""
+Export of the daily TradingData snapshot to report files.
+Every export goes to the file of its partition, reports/trades_<day or month>.<format>, so its cost is
+bounded by the size of one partition instead of growing with the whole history like trades_data.xlsx.
+The table is read once and its rows are streamed to every format: Excel files are written with openpyxl
+in write-only mode (the rows of the partition so far are streamed back from a read-only workbook) and CSV
+files are appended to, both ending every snapshot with a Total row. Parquet files, which need pyarrow or
+fastparquet, are rewritten from the partition so far and have no Total row.
+"""
+import csv
+import os
+import sys
+from datetime import datetime
+import openpyxl
+import pandas as pd
+import config
+import database
+
+COLUMNS = ["Date", "Symbol", "Quantity", "Last Price", "PnL"]
+PARTITION_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+
+
+def report_path(when, file_format, partition=None, report_dir=None):
+    """Returns the file holding the snapshots of when's day or month"""
+    partition = partition or config.report_partition
+    report_dir = report_dir or config.report_dir
+    return os.path.join(report_dir, f"trades_{when.strftime(PARTITION_FORMATS[partition])}.{file_format}")
+
+
+def snapshot_rows(date: str):
+    """Yields one report row per TradingData row, reading the table a page at a time"""
+    for data in database.iter_all_data():
+        yield [date, data.tradingsymbol, data.number_of_trades, round(data.last_price, 2), round(data.pnl, 2)]
+
+
+class XlsxReport:
+    """Rewrites an xlsx report in write-only mode: its previous rows, streamed from a read-only workbook, then the new ones"""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Trades")
+        if os.path.exists(file_name):
+            previous = openpyxl.load_workbook(file_name, read_only=True)
+            try:
+                for row in previous.worksheets[0].iter_rows(values_only=True):
+                    self.sheet.append(row)
+            finally:
+                previous.close()
+        else:
+            self.sheet.append(COLUMNS)
+
+    def append(self, row):
+        self.sheet.append(row)
+
+    def close(self, total_row):
+        self.sheet.append(total_row)
+        temp_name = self.file_name + ".tmp"
+        self.workbook.save(temp_name)
+        os.replace(temp_name, self.file_name)
+
+    def abort(self):
+        pass
+
+
+class CsvReport:
+    """Appends to a csv report, writing the header first if the file is new"""
+    def __init__(self, file_name):
+        new_file = not os.path.exists(file_name)
+        self.file = open(file_name, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(COLUMNS)
+
+    def append(self, row):
+        self.writer.writerow(row)
+
+    def close(self, total_row):
+        try:
+            self.writer.writerow(total_row)
+        finally:
+            self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class ParquetReport:
+    """
+    Rewrites a parquet report with its previous rows followed by the new ones, which are collected until close.
+    It has no Total row, as the typed Quantity and Last Price columns cannot hold one; sum the PnL column instead.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+
+    def close(self, total_row):
+        table = pd.DataFrame(self.rows, columns=COLUMNS)
+        if os.path.exists(self.file_name):
+            table = pd.concat([pd.read_parquet(self.file_name), table], ignore_index=True)
+        temp_name = self.file_name + ".tmp"
+        table.to_parquet(temp_name, index=False)
+        os.replace(temp_name, self.file_name)
+
+    def abort(self):
+        pass
+
+
+REPORTS = {"xlsx": XlsxReport, "csv": CsvReport, "parquet": ParquetReport}
+
+
+def export_report(formats=None, partition=None, report_dir=None, when=None):
+    """
+    Writes the current TradingData snapshot to the report file of today's partition in every format
+    of formats ("xlsx", "csv", "parquet"), by default config.report_formats. Returns the files written.
+    A format that fails is reported and skipped without stopping the others.
+    """
+    formats = formats or config.report_formats
+    report_dir = report_dir or config.report_dir
+    when = when or datetime.now()
+    os.makedirs(report_dir, exist_ok=True)
+    date = when.strftime("%Y-%m-%d %H:%M:%S")
+
+    def failed(file_name, e):
+        print(f"Failed to write report '{file_name}': {str(e)}")
+
+    reports = {}
+    for file_format in formats:
+        file_name = report_path(when, file_format, partition, report_dir)
+        if file_format not in REPORTS:
+            print(f"Unknown report format '{file_format}'")
+            continue
+        try:
+            reports[file_name] = REPORTS[file_format](file_name)
+        except (ImportError, OSError) as e:
+            failed(file_name, e)
+
+    # One pass over the table feeds every format, so the rows are never all held in memory
+    for row in snapshot_rows(date):
+        for file_name, report in list(reports.items()):
+            try:
+                report.append(row)
+            except (ImportError, OSError) as e:
+                failed(file_name, e)
+                report.abort()
+                del reports[file_name]
+
+    total_row = [date, "Total", "", "", database.get_total_pnl()]
+    written = []
+    for file_name, report in reports.items():
+        try:
+            report.close(total_row)
+        except (ImportError, OSError) as e:
+            failed(file_name, e)
+            continue
+        written.append(file_name)
+        print(f"Trading data written to '{file_name}'")
+    return written
+
+
+if __name__ == '__main__':
+    export_report(formats=sys.argv[1:] or None)
@@ -0,0 +1,55 @@
+"""
+Selects where the engine keeps its state, from config.state_backend:
+"excel" keeps it in the users' sheets through excel_functions, "sqlite" in the state database
+through database, with the sheets only written by database.export_user_to_excel.
+"""
+import os
+import config
+import database
+import excel_functions
+
+
+def sqlite_backend():
+    return config.state_backend == "sqlite"
+
+
+def load_user_state(user_id: str):
+    """
+    Reads the user's symbols, lots, last prices and access token in one pass.
+    The first time a user is read from the database, their sheet is imported into it.
+    """
+    if not sqlite_backend():
+        return excel_functions.load_user_state(user_id)
+    loaded = database.load_user_state(user_id)
+    if not loaded["symbols"] and os.path.exists("Excel sheets/" + user_id + ".xlsx"):
+        database.import_user_from_excel(user_id)
+        loaded = database.load_user_state(user_id)
+    return loaded
+
+
+def open_user_state(user_id: str, loaded=None):
+    """Returns the state object the engine updates: excel_functions.UserState or database.SqliteUserState"""
+    loaded = loaded if loaded is not None else load_user_state(user_id)
+    if sqlite_backend():
+        return database.SqliteUserState(user_id, loaded=loaded)
+    return excel_functions.UserState(user_id, loaded=loaded, flush_every_cycle=config.flush_state_every_cycle)
+
+
+def append_trading_orders(user_id: str, buy_trades, sell_trades, base_change):
+    if sqlite_backend():
+        database.append_trade_summary(user_id, buy_trades, sell_trades, base_change)
+    else:
+        excel_functions.append_trading_orders(user_id, buy_trades, sell_trades, base_change)
+
+
+def get_access_token(user_id: str):
+    if sqlite_backend():
+        return database.get_access_token(user_id)
+    return excel_functions.get_access_token(user_id)
+
+
+def set_access_token(user_id: str, token):
+    if sqlite_backend():
+        database.set_access_token(user_id, token)
+    else:
+        excel_functions.set_access_token(user_id, token)
@@ -0,0 +1,161 @@
+"""
+Runs the accounts in separate worker processes so they do not share one GIL.
+Each worker trades a shard of accounts with async_trading on its own event loop and reports a
+heartbeat. The supervisor restarts a worker that dies, stops reporting or finishes before market
+close; the restarted worker reloads its symbols, lots and last prices from the users' sheets, which workers
+write every cycle, and settles the orders the dead worker left open before it trades.
+At market close the workers are left to end their trading day and write their state on their own; a worker is
+only asked to stop, and killed if it does not, once it runs past the grace period or the supervisor is interrupted.
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+import async_trading
+import config
+import kite_metrics
+from multiple_trading import market_closed
+
+
+def shard(user_ids, accounts_per_worker: int):
+    """Splits user_ids into lists of at most accounts_per_worker accounts"""
+    user_ids = list(user_ids)
+    return [user_ids[start:start + accounts_per_worker] for start in range(0, len(user_ids), accounts_per_worker)]
+
+
+async def run_shard(index: int, user_ids, heartbeats, stop_event, symbols: dict, exchange: str, percent: int):
+    """Trades the accounts of one shard while beating its heartbeat, until they finish or stop_event is set"""
+    trading = asyncio.create_task(async_trading.run_accounts(user_ids, symbols, exchange, percent))
+    while not trading.done():
+        # Written from the event loop, so the heartbeat goes stale when the loop is blocked
+        heartbeats[index] = time.time()
+        if stop_event.is_set():
+            # Cancelling still flushes every account's state in run_account
+            trading.cancel()
+            break
+        await asyncio.wait({trading}, timeout=config.heartbeat_interval)
+    await asyncio.gather(trading, return_exceptions=True)
+
+
+def worker_main(index: int, user_ids, heartbeats, stop_event, symbols: dict, exchange: str, percent: int):
+    """Entry point of a worker process. Exits with 1 if trading ended before market close, so it is restarted."""
+    print(f"Worker {index}: Trading {', '.join(user_ids)}")
+    # One metrics file per worker, as every process has its own registry
+    name, extension = os.path.splitext(config.metrics_file)
+    kite_metrics.start_dump(f"{name}_worker{index}{extension}")
+    # A worker can be killed at any time, so its state is written every cycle rather than every 30 seconds
+    config.flush_state_every_cycle = True
+    asyncio.run(run_shard(index, user_ids, heartbeats, stop_event, symbols, exchange, percent))
+    if not stop_event.is_set() and not market_closed():
+        print(f"Worker {index}: Trading ended before market close.")
+        sys.exit(1)
+
+
+class Supervisor:
+    """
+    Class to run and watch one worker process per shard of accounts.
+    target is the worker entry point, called as target(index, user_ids, heartbeats, stop_event, symbols, exchange, percent).
+    """
+    def __init__(self, user_ids, symbols: dict, exchange: str, percent: int, accounts_per_worker=config.accounts_per_worker, target=worker_main):
+        self.shards = shard(user_ids, accounts_per_worker)
+        self.symbols = symbols
+        self.exchange = exchange
+        self.percent = percent
+        self.target = target
+        # spawn gives every worker a fresh interpreter, without the supervisor's threads or sockets
+        self.context = multiprocessing.get_context("spawn")
+        self.heartbeats = self.context.Array("d", len(self.shards), lock=False)
+        self.stop_event = self.context.Event()
+        self.workers = [None] * len(self.shards)
+        self.restarts = [0] * len(self.shards)
+
+    def start_worker(self, index: int):
+        self.heartbeats[index] = time.time()
+        worker = self.context.Process(target=self.target, name=f"trading-worker-{index}",
+                                      args=(index, self.shards[index], self.heartbeats, self.stop_event, self.symbols, self.exchange, self.percent))
+        worker.start()
+        self.workers[index] = worker
+
+    def check_workers(self):
+        """Restarts the workers that exited early or stopped reporting, up to config.max_restarts times each"""
+        for index, worker in enumerate(self.workers):
+            if worker is None:
+                continue
+            shard_ids = ", ".join(self.shards[index])
+            if worker.is_alive():
+                stale = time.time() - self.heartbeats[index]
+                if stale < config.heartbeat_timeout:
+                    continue
+                print(f"Supervisor: Worker {index} ({shard_ids}) sent no heartbeat for {int(stale)} seconds. Killing it...")
+                worker.kill()
+                worker.join()
+            elif worker.exitcode == 0:
+                print(f"Supervisor: Worker {index} ({shard_ids}) finished.")
+                self.workers[index] = None
+                continue
+            else:
+                print(f"Supervisor: Worker {index} ({shard_ids}) exited with code {worker.exitcode}.")
+
+            if self.restarts[index] >= config.max_restarts:
+                print(f"Supervisor: Worker {index} ({shard_ids}) restarted {self.restarts[index]} times. Giving up on it.")
+                self.workers[index] = None
+                continue
+            self.restarts[index] += 1
+            print(f"Supervisor: Restarting worker {index} ({shard_ids}), restart {self.restarts[index]}...")
+            self.start_worker(index)
+
+    def join_workers(self, timeout):
+        """Waits up to timeout seconds in total for the workers to exit. Returns whether they all have."""
+        deadline = time.monotonic() + timeout
+        for index, worker in enumerate(self.workers):
+            if worker is None:
+                continue
+            worker.join(max(0, deadline - time.monotonic()))
+            if not worker.is_alive():
+                self.workers[index] = None
+        return not any(self.workers)
+
+    def stop(self, grace_period=120, finish=False, stop_timeout=30):
+        """
+        Stops every worker, killing the ones still running at the end.
+        With finish, at market close, the workers get grace_period seconds to end their trading day on their own,
+        as setting stop_event would cancel their last reconciliation and summary; the ones still running after it
+        are asked to stop and get stop_timeout seconds more. Otherwise, e.g. on an interrupt, they are asked to
+        stop right away and get grace_period seconds to write their state.
+        """
+        timeout = grace_period
+        if finish:
+            if self.join_workers(grace_period):
+                return
+            print(f"Supervisor: Workers still running {grace_period} seconds after market close. Asking them to stop...")
+            timeout = stop_timeout
+        self.stop_event.set()
+        self.join_workers(timeout)
+        for index, worker in enumerate(self.workers):
+            if worker is None:
+                continue
+            print(f"Supervisor: Worker {index} did not stop in time. Killing it...")
+            worker.kill()
+            worker.join()
+            self.workers[index] = None
+
+    def run(self):
+        """Starts every worker and watches them until market close or until they have all finished"""
+        for index in range(len(self.shards)):
+            self.start_worker(index)
+        finish = False
+        try:
+            while not market_closed() and any(self.workers):
+                time.sleep(config.heartbeat_interval)
+                self.check_workers()
+            print("Supervisor: Market closed. Waiting for workers to finish the trading day...")
+            finish = True
+        except KeyboardInterrupt:
+            print("Supervisor: Interrupted. Stopping workers...")
+        finally:
+            self.stop(finish=finish)
+
+
+if __name__ == '__main__':
+    Supervisor(config.ID, config.shares_quantity, "NSE", 3).run()
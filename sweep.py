@@ -0,0 +1,119 @@
+"""
+Parameter sweep for the grid strategy on historical bars.
+Every combination of grid percent, max lots, daily buy cap and NIFTY floor is backtested with
+backtest.backtest, either across the whole universe or per symbol, on a process pool using all cores.
+The price, day and NIFTY arrays are placed once in shared memory and mapped read-only by the workers.
+"""
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import config
+import backtest
+
+# Arrays of the sweep, mapped from shared memory in every worker process
+shared_arrays = {}
+
+
+def share_array(array):
+    """Copies array into a new shared memory block. Returns the block and the (name, shape, dtype) to attach to it."""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_arrays(specs):
+    """Pool initializer mapping the shared arrays of the sweep read-only into the worker"""
+    for key, (name, shape, dtype) in specs.items():
+        # The parent owns the blocks and unlinks them when the sweep ends
+        block = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.flags.writeable = False
+        shared_arrays[key] = (block, array)
+
+
+def run_combination(task):
+    """Backtests one parameter combination on every symbol (column None) or on a single column"""
+    params, column = task
+    prices = shared_arrays["prices"][1]
+    quantities = shared_arrays["quantities"][1]
+    if column is not None:
+        prices = prices[:, column:column + 1]
+        quantities = quantities[column:column + 1]
+    result = backtest.backtest(prices, params["percent"], quantities, shared_arrays["days"][1], shared_arrays["nifty"][1],
+                               max_lots=params["max_lots"], daily_buy_cap=params["daily_buy_cap"], nifty_floor=params["nifty_floor"])
+    return {
+        **params,
+        "column": column,
+        "buy_trades": int(result["buy_trades"].sum()),
+        "sell_trades": int(result["sell_trades"].sum()),
+        "base_changes": int(result["base_changes"].sum()),
+        "realized_pnl": float(result["realized_pnl"].sum()),
+        "unrealized_pnl": float(result["unrealized_pnl"].sum()),
+    }
+
+
+def sweep(prices, days=None, nifty_day_change=None, symbols=None, quantities=None, percents=(3,), max_lots=(5,),
+          daily_buy_caps=(50,), nifty_floors=(-4,), per_symbol=False, workers=None):
+    """
+    Backtests every combination of the given parameter values and returns a table ranked by realized PnL.
+    With per_symbol, every symbol is backtested on its own, with its own daily buy cap, and ranked
+    within the table by symbol; otherwise the universe is traded together like the live engine does.
+    """
+    prices = np.asarray(prices, dtype=float)
+    bar_count, symbol_count = prices.shape
+    symbols = list(symbols) if symbols is not None else list(range(symbol_count))
+    arrays = {
+        "prices": prices,
+        "days": np.zeros(bar_count, dtype=int) if days is None else np.asarray(days),
+        "nifty": np.zeros(bar_count) if nifty_day_change is None else np.asarray(nifty_day_change, dtype=float),
+        "quantities": np.ones(symbol_count) if quantities is None else np.asarray(quantities, dtype=float),
+    }
+    combinations = [dict(zip(("percent", "max_lots", "daily_buy_cap", "nifty_floor"), values))
+                    for values in itertools.product(percents, max_lots, daily_buy_caps, nifty_floors)]
+    columns = range(symbol_count) if per_symbol else [None]
+    tasks = [(params, column) for params in combinations for column in columns]
+
+    blocks = []
+    try:
+        specs = {}
+        for key, array in arrays.items():
+            block, specs[key] = share_array(array)
+            blocks.append(block)
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_arrays, initargs=(specs,)) as pool:
+            rows = list(pool.map(run_combination, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    table = pd.DataFrame(rows)
+    table.insert(0, "symbol", ["ALL" if column is None else symbols[column] for column in table.pop("column")])
+    table["total_pnl"] = table["realized_pnl"] + table["unrealized_pnl"]
+    if per_symbol:
+        table = table.sort_values(["symbol", "realized_pnl"], ascending=[True, False])
+    else:
+        table = table.sort_values("realized_pnl", ascending=False)
+    return table.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        timestamps, symbols, prices, nifty = backtest.load_minute_bars(sys.argv[1])
+        days = pd.DatetimeIndex(timestamps).normalize().to_numpy()
+        quantities = [config.shares_quantity.get(symbol, 1) for symbol in symbols]
+    else:
+        nifty, quantities = None, None
+        days, prices = backtest.random_walk_bars(days=60)
+        symbols = [f"SYMBOL{index}" for index in range(prices.shape[1])]
+    start = time.perf_counter()
+    table = sweep(prices, days, nifty, symbols, quantities, percents=(1, 2, 3, 4, 5), max_lots=(3, 5, 8),
+                  daily_buy_caps=(25, 50, 100), nifty_floors=(-2, -4))
+    print(table.head(20).to_string())
+    print(f"Swept {len(table)} combinations over {prices.shape[0]} bars x {prices.shape[1]} symbols in {time.perf_counter() - start:.1f} s")